@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,4 +9,25 @@ API_HASH = os.getenv("API_HASH")
 SESSION_NAME = os.getenv("SESSION_NAME", "userbot")
 
 TARGET_CHAT_ID = int(os.getenv("TARGET_CHAT_ID"))
-TARGET_SENDER_ID = int(os.getenv("TARGET_SENDER_ID"))
\ No newline at end of file
+TARGET_SENDER_ID = int(os.getenv("TARGET_SENDER_ID"))
+
+# Hot-standby: set LEADER_LOCK_DIR (shared by all instances) to enable leader election.
+# Every instance then needs:
+#   - its own SESSION_NAME: one Telegram session used from two places gets
+#     AuthKeyDuplicatedError and is invalidated (log each instance in once)
+#   - the same STATE_DIR (defaults to LEADER_LOCK_DIR), so state.json, outbox.json and
+#     the fencing token are shared and a standby resumes where the leader stopped
+LEADER_LOCK_DIR = os.getenv("LEADER_LOCK_DIR")
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEADER_LEASE_SEC = int(os.getenv("LEADER_LEASE_SEC", "15"))
+STATE_DIR = os.getenv("STATE_DIR") or LEADER_LOCK_DIR or "."
+
+if LEADER_LOCK_DIR and not os.getenv("SESSION_NAME"):
+    raise RuntimeError("LEADER_LOCK_DIR is set: give every instance its own SESSION_NAME")
+
+# Local control/health API (JSON lines over a Unix socket); empty string disables it.
+# In leader mode the default is per instance, so instances sharing a directory don't
+# collide; it needs a stable INSTANCE_ID so monitoring can poll a fixed path.
+if LEADER_LOCK_DIR and not os.getenv("INSTANCE_ID") and os.getenv("CONTROL_SOCKET") is None:
+    raise RuntimeError("LEADER_LOCK_DIR is set: set a stable INSTANCE_ID (or CONTROL_SOCKET) per instance")
+CONTROL_SOCKET = os.getenv("CONTROL_SOCKET", f"userbot-{INSTANCE_ID}.sock" if LEADER_LOCK_DIR else "userbot.sock")
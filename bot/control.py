@@ -0,0 +1,189 @@
+"""
+Local control API on a Unix domain socket (JSON lines), independent of Telegram.
+
+Request (one JSON object per line):
+  {"cmd": "health"}                      -> liveness: event loop answering
+  {"cmd": "ready"}                       -> readiness: connected, leader role, scheduler tasks
+  {"cmd": "metrics"}                     -> uptime, memory, cpu, tasks, rules, events
+  {"cmd": ".status", "args": []}         -> any COMMAND_HANDLERS entry
+Response (one line): {"ok": true, ...} or {"ok": false, "error": "..."}
+
+Example (with LEADER_LOCK_DIR set the default path is userbot-<INSTANCE_ID>.sock):
+  echo '{"cmd": "health"}' | socat - UNIX-CONNECT:userbot.sock
+"""
+import asyncio
+import html
+import json
+import os
+import re
+
+import psutil
+
+from .client import client
+from .config import CONTROL_SOCKET
+from .scheduler import clock, leader, manager
+from utils.logger import logger
+from utils import eventlog
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+MAX_LINE = 64 * 1024
+
+# inode of the socket file this process bound, so shutdown only removes its own
+_bound_inode: int | None = None
+
+# One Process object: psutil measures cpu_percent since the previous call on the same object
+_PROC = psutil.Process()
+
+
+class _SocketEvent:
+    """Quacks like a Telethon NewMessage event for command handlers; collects replies."""
+
+    # Files sent by handlers (exportlogs, profile, ...) go to Saved Messages
+    chat_id = "me"
+    id = None
+
+    def __init__(self, raw_text: str):
+        self.raw_text = raw_text
+        self.replies: list[str] = []
+
+    async def reply(self, text, parse_mode=None, **kwargs):
+        if parse_mode == "html":
+            text = html.unescape(_TAG_RE.sub("", text))
+        self.replies.append(text)
+
+    async def get_chat(self):
+        return None
+
+
+def _health() -> dict:
+    return {"ok": True, "status": "alive", "ts": clock.now()}
+
+def _ready() -> dict:
+    connected = client.is_connected()
+    tasks = {tid: info.status for tid, info in manager.SUPERVISED.items()}
+    scheduling = leader.is_leader() and any(s == "running" for s in tasks.values())
+    return {
+        "ok": True,
+        "ready": connected and (scheduling or not leader.is_leader()),
+        "connected": connected,
+        "leader": leader.role(),
+        "tasks": tasks,
+    }
+
+def _metrics() -> dict:
+    from . import handlers, rules
+
+    engine = rules.engine
+    return {
+        "ok": True,
+        "uptime_sec": round(clock.monotonic() - handlers.START_TIME, 1),
+        "rss_bytes": _PROC.memory_info().rss,
+        "cpu_percent": _PROC.cpu_percent(interval=None),
+        "asyncio_tasks": len(asyncio.all_tasks()),
+        "connected": client.is_connected(),
+        "leader": leader.is_leader(),
+        "tasks": {
+            tid: {
+                "status": info.status,
+                "uptime_sec": round(info.uptime(), 1),
+                "restarts": info.restarts,
+                "last_error": info.last_error,
+            }
+            for tid, info in manager.SUPERVISED.items()
+        },
+        "rules": {
+            "loaded": len(engine.rules),
+            "matched": engine.match_count,
+            "match_time_total_sec": round(engine.match_time_total, 6),
+            "fires": dict(engine.fires),
+        },
+    }
+
+async def _run_command(cmd: str, args: list[str]) -> dict:
+    from .handlers import COMMAND_HANDLERS
+
+    handler = COMMAND_HANDLERS.get(cmd.lower())
+    if handler is None:
+        return {"ok": False, "error": f"unknown command {cmd}"}
+
+    event = _SocketEvent(" ".join([cmd, *args]))
+    started = clock.monotonic()
+    try:
+        await handler(event, *args)
+    finally:
+        eventlog.emit("command", duration=clock.monotonic() - started, command=cmd, source="socket")
+    return {"ok": True, "replies": event.replies}
+
+async def _dispatch(request: dict) -> dict:
+    cmd = str(request.get("cmd", ""))
+    if cmd == "health":
+        return _health()
+    if cmd == "ready":
+        return _ready()
+    if cmd == "metrics":
+        return _metrics()
+    if cmd.startswith("."):
+        args = [str(a) for a in request.get("args", [])]
+        return await _run_command(cmd, args)
+    return {"ok": False, "error": f"unknown request {cmd!r}"}
+
+async def _handle_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while line := await reader.readline():
+            try:
+                response = await _dispatch(json.loads(line))
+            except json.JSONDecodeError as e:
+                response = {"ok": False, "error": f"bad json: {e}"}
+            except Exception as e:
+                logger.error(f"[CONTROL] ❌ request failed: {e}")
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+    except (ConnectionResetError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def _socket_alive(path: str) -> bool:
+    """True if something is accepting connections on the socket file."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), timeout=2)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def serve():
+    """Run the control socket until cancelled. Empty CONTROL_SOCKET disables it."""
+    if not CONTROL_SOCKET:
+        return
+    if os.path.exists(CONTROL_SOCKET):
+        if await _socket_alive(CONTROL_SOCKET):
+            logger.error(f"[CONTROL] ❌ {CONTROL_SOCKET} is served by another instance, control API disabled")
+            return
+        os.unlink(CONTROL_SOCKET)   # stale socket from a previous run
+
+    server = await asyncio.start_unix_server(_handle_conn, path=CONTROL_SOCKET, limit=MAX_LINE)
+    os.chmod(CONTROL_SOCKET, 0o600)
+    global _bound_inode
+    _bound_inode = os.stat(CONTROL_SOCKET).st_ino
+    logger.info(f"[CONTROL] 🔌 Control socket listening on {CONTROL_SOCKET}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        remove_socket()
+
+def remove_socket():
+    """Delete our socket file on shutdown (also called before os._exit/execv, which skip finally)."""
+    global _bound_inode
+    if _bound_inode is None:
+        return
+    try:
+        # Never remove a socket another instance has bound at the same path since
+        if os.stat(CONTROL_SOCKET).st_ino == _bound_inode:
+            os.unlink(CONTROL_SOCKET)
+    except FileNotFoundError:
+        pass
+    _bound_inode = None
@@ -1,15 +1,17 @@
 import os
 import sys
 import json
+import asyncio
 import psutil
 from telethon import events, Button
-from datetime import datetime
 from .client import client
 from .config import TARGET_CHAT_ID
 from utils.logger import logger, LOG_FILE
-from .scheduler.storage import load_state, save_state
+from utils import eventlog
+from .scheduler import clock, leader, task_runner_work
+from .scheduler.storage import STATE_FILE, load_state, save_state
 
-START_TIME = datetime.now()
+START_TIME = clock.monotonic()
 SELF_USER = 'me'
 
 AVAILABLE_JOBS = [
@@ -19,6 +21,7 @@ AVAILABLE_JOBS = [
 ]
 
 COMMAND_HANDLERS = {}
+STANDBY_COMMANDS = {".leader"}
 
 def command(name):
     def wrapper(func):
@@ -44,9 +47,18 @@ async def handle_message(event):
     cmd = parts[0].lower()
     args = parts[1:] 
 
+    # Standby instances stay silent; only .leader is answered by every instance
+    if not leader.is_leader() and cmd not in STANDBY_COMMANDS:
+        return
+
     handler = COMMAND_HANDLERS.get(cmd)
     if handler:
-        await handler(event, *args)
+        started = clock.monotonic()
+        try:
+            await handler(event, *args)
+        finally:
+            eventlog.emit("command", chat_id=event.chat_id, msg_id=event.id,
+                          duration=clock.monotonic() - started, command=cmd)
 
 # === 📌 Commands ===
 
@@ -61,16 +73,23 @@ async def handle_help(event):
 <code>.cycle_set</code> — set custom next start time for work cycle
 <code>.ping</code> — check if the bot is alive, replies with "pong 🏓"
 <code>..status</code> — show status of all active tasks
+<code>.tasks</code> — show supervised task health (uptime, restarts, last error)
 <code>.logs</code> — show the latest status updates from all active tasks
 <code>.exportlogs</code> — send the full userbot log file as a document
-<code>.clearlogs</code> — clear the userbot log file  
+<code>.clearlogs</code> — clear the userbot log and event files  
+<code>.events [task_id] [n]</code> — show the latest structured scheduler events
+<code>.exportevents</code> — send all events as a gzipped columnar JSON file
 <code>.state</code> — send the current state.json contents as a formatted JSON block
 <code>.time</code> — show current server time  
 <code>.uptime</code> — show how long the bot has been running
 <code>.stop</code> — fully stop the userbot process
+<code>.leader</code> — show leader/standby role of each running instance
 <code>.reload</code> — reload the userbot code without restarting
 <code>.cpu</code> — show current CPU usage
 <code>.mem</code> — show current memory usage
+<code>.memprof start|snapshot|diff|stop</code> — trace process allocations and diff snapshots
+<code>.profile [seconds]</code> — sample CPU stacks and attach a flame-graph file
+<code>.rules</code> — show auto-reply rule stats (<code>.rules reload</code> to re-read rules.json)
 """
     logger.info("ℹ️ Received .help — sending list of commands")
     await event.reply(help_text, parse_mode="html")
@@ -197,8 +216,9 @@ async def handle_clearlog(event):
     try:
         with open(LOG_FILE, "w", encoding="utf-8") as f:
             f.truncate(0)
+        eventlog.clear()
         logger.info("🧹 Log file cleared via .clearlog")
-        await event.reply("🧹 Log file has been cleared.")
+        await event.reply("🧹 Log and event files have been cleared.")
     except Exception as e:
         logger.error(f"❌ Failed to clear log: {e}")
         await event.reply("❌ Failed to clear log file.")
@@ -208,10 +228,7 @@ async def handle_export_state(event, *args):
     """
     Send the current contents of state.json as a formatted JSON text block.
     """
-    # Path to state.json in the project root
-    path = os.path.join(os.getcwd(), "state.json")
-    
-    if os.path.exists(path):
+    if os.path.exists(STATE_FILE):
         # Load the state dictionary
         state = load_state()
         # Pretty-print with 2-space indent
@@ -227,8 +244,8 @@ async def handle_export_state(event, *args):
 
 @command(".uptime")
 async def handle_uptime(event):
-    uptime = datetime.now() - START_TIME
-    hours, remainder = divmod(int(uptime.total_seconds()), 3600)
+    uptime = clock.monotonic() - START_TIME
+    hours, remainder = divmod(int(uptime), 3600)
     minutes, _ = divmod(remainder, 60)
 
     logger.info("ℹ️ Received .uptime — replying with bot uptime")
@@ -255,7 +272,7 @@ async def handle_nextwork(event):
 
 @command(".time")
 async def handle_time(event):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    now = clock.fmt(clock.now())
     logger.info(f"🕒 Received .time — replying with {now}")
     await event.reply(f"🕒 Current time:\n<code>{now}</code>", parse_mode="html")
 
@@ -263,6 +280,10 @@ async def handle_time(event):
 async def handle_stop(event):
     logger.info("🛑 Received .stop — force quitting userbot...")
     await event.reply("🔌 Userbot is shutting down now.")
+    await leader.release()
+    eventlog.flush()
+    from . import control
+    control.remove_socket()
     await client.disconnect()
     os._exit(0)
 
@@ -273,6 +294,10 @@ async def handle_reload(event):
 
     logger.info("🔄 Received .reload — restarting userbot code...")
     await event.reply("♻️ Reloading...")
+    await leader.release()
+    eventlog.flush()
+    from . import control
+    control.remove_socket()
 
     os.execv(sys.executable, [sys.executable, "-m", "bot.main"])
 
@@ -303,7 +328,6 @@ async def handle_cycle_status(event):
     Show current work_cycle status with human-readable remaining time.
     """
     import html
-    from datetime import datetime
 
     state = load_state()
     wc = state.get("work_cycle", {})
@@ -311,45 +335,29 @@ async def handle_cycle_status(event):
     def _get(k, default=None):
         return wc.get(k, default)
 
-    def _fmt_dt(s):
-        return s if isinstance(s, str) else s  # load_state already stores strings
-    def _parse_dt(s):
-        try:
-            return datetime.strptime(s, "%Y-%m-%d %H:%M:%S") if s else None
-        except Exception:
-            return None
-
-    now = datetime.now()
+    now = clock.now()
 
     current_job      = _get("current_job", "@toadbot Поход в столовую")
-    next_start_at_s  = _get("next_start_at")
-    scheduled_end_at_s = _get("scheduled_end_at")
+    next_start_at    = _get("next_start_at")
+    scheduled_end_at = _get("scheduled_end_at")
     scheduled_end_id = _get("scheduled_end_id")
-    last_end_at_s    = _get("last_end_at")
-
-    next_start_at    = _parse_dt(next_start_at_s)
-    scheduled_end_at = _parse_dt(scheduled_end_at_s)
-    last_end_at      = _parse_dt(last_end_at_s)
+    last_end_at      = _get("last_end_at")
 
     # Figure out the next upcoming event and time remaining
     upcoming_label = "—"
     eta_str = "—"
     if scheduled_end_at:
         upcoming_label = "End work (scheduled)"
-        delta = (scheduled_end_at - now).total_seconds()
+        delta = scheduled_end_at - now
         if delta >= 0:
-            m, s = divmod(int(delta), 60)
-            h, m = divmod(m, 60)
-            eta_str = f"{h}h {m}m"
+            eta_str = clock.fmt_duration(delta)
         else:
             eta_str = "any minute (waiting to be delivered)"
     elif next_start_at:
         upcoming_label = "Start work"
-        delta = (next_start_at - now).total_seconds()
+        delta = next_start_at - now
         if delta >= 0:
-            m, s = divmod(int(delta), 60)
-            h, m = divmod(m, 60)
-            eta_str = f"{h}h {m}m"
+            eta_str = clock.fmt_duration(delta)
         else:
             eta_str = "due now"
 
@@ -357,10 +365,10 @@ async def handle_cycle_status(event):
     lines = [
         "🧭 <b>Work Cycle Status</b>",
         f"👔 <b>Current job:</b> <code>{html.escape(current_job)}</code>",
-        f"🕑 <b>Next start at:</b> <code>{html.escape(next_start_at_s or '—')}</code>",
-        f"⏳ <b>Scheduled end at:</b> <code>{html.escape(scheduled_end_at_s or '—')}</code>",
+        f"🕑 <b>Next start at:</b> <code>{html.escape(clock.fmt(next_start_at, '—'))}</code>",
+        f"⏳ <b>Scheduled end at:</b> <code>{html.escape(clock.fmt(scheduled_end_at, '—'))}</code>",
         f"🧾 <b>Scheduled end msg_id:</b> <code>{html.escape(str(scheduled_end_id) if scheduled_end_id else '—')}</code>",
-        f"✅ <b>Last end at:</b> <code>{html.escape(last_end_at_s or '—')}</code>",
+        f"✅ <b>Last end at:</b> <code>{html.escape(clock.fmt(last_end_at, '—'))}</code>",
         "",
         f"📌 <b>Upcoming:</b> <code>{html.escape(upcoming_label)}</code>",
         f"⏱️ <b>Time remaining:</b> <code>{html.escape(eta_str)}</code>",
@@ -374,17 +382,17 @@ async def handle_cycle_skip(event):
     """
     Skip current waiting period and start job immediately.
     """
-    from datetime import datetime
     state = load_state()
     wc = state.get("work_cycle", {})
 
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    wc["next_start_at"] = now_str
+    wc["next_start_at"] = clock.now()
     wc["scheduled_end_at"] = None
     wc["scheduled_end_id"] = None
     state["work_cycle"] = wc
     save_state(state)
 
+    task_runner_work.wake()
+
     logger.info("[work_cycle_skip] ⏩ Current cycle skipped — starting now")
     await event.reply("⏩ Skipped current cycle.\n▶️ Next job will start immediately.")
 
@@ -396,38 +404,37 @@ async def handle_cycle_set(event, *args):
       .cycle_set 2025-08-09 20:15:00   -> absolute time
       .cycle_set +30                   -> relative in minutes
     """
-    from datetime import datetime, timedelta
-
     if not args:
         await event.reply("❌ Usage:\n<code>.cycle_set YYYY-MM-DD HH:MM:SS</code>\n<code>.cycle_set +30</code> (minutes)", parse_mode="html")
         return
 
     arg = " ".join(args).strip()
-    now = datetime.now()
 
     # Relative format
     if arg.startswith("+"):
         try:
-            minutes = int(arg[1:])
-            new_time = now + timedelta(minutes=minutes)
+            new_ts = clock.now() + int(arg[1:]) * 60
         except ValueError:
             await event.reply("❌ Invalid minutes format.")
             return
     else:
         try:
-            new_time = datetime.strptime(arg, "%Y-%m-%d %H:%M:%S")
+            new_ts = clock.parse_local(arg)
         except ValueError:
             await event.reply("❌ Invalid time format. Use: YYYY-MM-DD HH:MM:SS")
             return
+    new_time = clock.fmt(new_ts)
 
     state = load_state()
     wc = state.get("work_cycle", {})
-    wc["next_start_at"] = new_time.strftime("%Y-%m-%d %H:%M:%S")
+    wc["next_start_at"] = new_ts
     wc["scheduled_end_at"] = None
     wc["scheduled_end_id"] = None
     state["work_cycle"] = wc
     save_state(state)
 
+    task_runner_work.wake()
+
     logger.info(f"[work_cycle_set] ⏳ Next start manually set to {new_time}")
     await event.reply(f"⏳ Next job start manually set to:\n<code>{new_time}</code>", parse_mode="html")
 
@@ -437,7 +444,8 @@ async def handle_status(event):
     Show the status of all active tasks from state.json
     """
     state = load_state()
-    if not state:
+    # load_state() always carries the schema marker; only task entries count
+    if not any(isinstance(v, dict) for v in state.values()):
         await event.reply("📭 No state data found.")
         return
 
@@ -447,9 +455,9 @@ async def handle_status(event):
         if not isinstance(task_state, dict):
             continue
 
-        last_sent = task_state.get("last_sent") or task_state.get("last_end_at") or "—"
-        next_start = task_state.get("next_start_at") or "—"
-        scheduled_end = task_state.get("scheduled_end_at") or "—"
+        last_sent = clock.fmt(task_state.get("last_sent") or task_state.get("last_end_at"), "—")
+        next_start = clock.fmt(task_state.get("next_start_at"), "—")
+        scheduled_end = clock.fmt(task_state.get("scheduled_end_at"), "—")
         scheduled_id = task_state.get("scheduled_end_id") or "—"
 
         lines.append(
@@ -460,6 +468,229 @@ async def handle_status(event):
             f"\n  • End msg ID: <code>{scheduled_id}</code>"
         )
 
+        queue = task_state.get("queue")
+        if queue:
+            lines.append(
+                f"  • Pre-booked: <code>{len(queue)} sends until {clock.fmt(queue[-1]['at'])}</code>"
+            )
+
+        last_run = task_state.get("last_run")
+        if last_run:
+            lines.append(
+                f"  • Broadcast: <code>{last_run['ok']} ok / {len(last_run['failed'])} failed "
+                f"in {last_run['duration']}s</code>"
+            )
+
     msg = "\n".join(lines)
     await event.reply(msg, parse_mode="html")
     logger.info("[work_cycle_status] 📤 Sent .status")
+
+@command(".rules")
+async def handle_rules(event, *args):
+    """
+    Show trigger rule statistics.
+    Usage:
+      .rules          -> fire counts and matching cost
+      .rules reload   -> re-read rules.json
+    """
+    from . import rules
+
+    if args and args[0].lower() == "reload":
+        engine = rules.load_rules()
+        await event.reply(f"♻️ Reloaded {len(engine.rules)} rules.")
+        return
+
+    engine = rules.engine
+    avg_us = engine.match_time_total / engine.match_count * 1e6 if engine.match_count else 0.0
+    lines = [
+        "🎯 <b>Trigger Rules</b>",
+        f"📜 <b>Rules loaded:</b> <code>{len(engine.rules)}</code>",
+        f"🔎 <b>Messages matched:</b> <code>{engine.match_count}</code>",
+        f"⏱️ <b>Match time:</b> <code>avg {avg_us:.1f}µs / max {engine.match_time_max * 1e6:.1f}µs</code>",
+    ]
+    top = engine.fires.most_common(15)
+    if top:
+        lines.append("")
+        lines.append("🔥 <b>Top fired:</b>")
+        for rule_id, count in top:
+            lines.append(f"  • <code>{rule_id}</code>: {count}")
+
+    await event.reply("\n".join(lines), parse_mode="html")
+    logger.info("[rules_status] 📤 Sent .rules")
+
+@command(".tasks")
+async def handle_tasks(event):
+    """
+    Show supervisor view of every scheduler task.
+    """
+    import html
+    from .scheduler import manager
+
+    if not manager.SUPERVISED:
+        await event.reply("📭 No supervised tasks running.")
+        return
+
+    icons = {"running": "🟢", "backoff": "🟡", "failed": "🔴", "finished": "⚪", "pending": "⚪"}
+    lines = ["🧩 <b>Supervised Tasks</b>"]
+    for task_id, info in manager.SUPERVISED.items():
+        lines.append(
+            f"\n{icons.get(info.status, '⚪')} <b>{html.escape(task_id)}</b> — <code>{info.status}</code>"
+            f"\n  • Uptime: <code>{clock.fmt_duration(info.uptime())}</code>"
+            f"\n  • Restarts: <code>{info.restarts}</code>"
+            f"\n  • Last error: <code>{html.escape(info.last_error or '—')}</code>"
+            f"\n  • Last error at: <code>{clock.fmt(info.last_error_at, '—')}</code>"
+        )
+
+    await event.reply("\n".join(lines), parse_mode="html")
+    logger.info("[supervisor_status] 📤 Sent .tasks")
+
+@command(".leader")
+async def handle_leader(event):
+    """
+    Show this instance's role in leader election.
+    """
+    info = leader.role()
+    if not info["enabled"]:
+        await event.reply("👑 Leader election disabled — single instance mode.")
+        return
+
+    role = "👑 leader" if info["leader"] else "💤 standby"
+    lines = [
+        f"🏷 <b>Instance:</b> <code>{info['instance']}</code>",
+        f"🎭 <b>Role:</b> <code>{role}</code>",
+        f"🔑 <b>Fencing token:</b> <code>{info['token'] or '—'}</code>",
+        f"⏳ <b>Lease until:</b> <code>{clock.fmt(info['lease_expires_at'] or None, '—')}</code>",
+    ]
+    await event.reply("\n".join(lines), parse_mode="html")
+    logger.info(f"[leader_status] 📤 Sent .leader ({role})")
+
+@command(".memprof")
+async def handle_memprof(event, *args):
+    """
+    In-process memory profiling via tracemalloc.
+    Usage:
+      .memprof start      -> start tracing, take baseline snapshot
+      .memprof snapshot   -> take a new snapshot (previous one becomes diff base)
+      .memprof diff       -> top allocation sites by size/count growth + asyncio task counts
+      .memprof stop       -> stop tracing and drop snapshots
+    """
+    import io
+    import html
+    from utils import memprof
+
+    sub = args[0].lower() if args else ""
+    rss_mb = psutil.Process().memory_info().rss / (1024 ** 2)
+
+    if sub == "start":
+        await asyncio.to_thread(memprof.start)
+        text = f"🔬 tracemalloc started (baseline taken)\nRSS: {rss_mb:.1f} MiB"
+    elif sub == "stop":
+        memprof.stop()
+        text = f"🔬 tracemalloc stopped\nRSS: {rss_mb:.1f} MiB"
+    elif not memprof.is_running():
+        await event.reply("❌ Not tracing. Run <code>.memprof start</code> first.", parse_mode="html")
+        return
+    elif sub == "snapshot":
+        text = await asyncio.to_thread(memprof.snapshot) + f"\nRSS: {rss_mb:.1f} MiB"
+    elif sub == "diff":
+        report = await asyncio.to_thread(memprof.diff)
+        text = f"RSS: {rss_mb:.1f} MiB\n\n{report}\n\n{memprof.task_counts()}"
+    else:
+        await event.reply("❌ Usage: <code>.memprof start|snapshot|diff|stop</code>", parse_mode="html")
+        return
+
+    logger.info(f"[memprof] 🔬 .memprof {sub}")
+    if len(text) > 3500:
+        report_file = io.BytesIO(text.encode("utf-8"))
+        report_file.name = "memprof.txt"
+        await client.send_file(event.chat_id, report_file, caption="🔬 Memory profile")
+    else:
+        await event.reply(f"<code>{html.escape(text)}</code>", parse_mode="html")
+
+@command(".profile")
+async def handle_profile(event, *args):
+    """
+    Sampling CPU profile of the live process (event loop + worker threads).
+    Usage:
+      .profile        -> 10 seconds
+      .profile 30     -> 30 seconds (max 120)
+    Attaches collapsed stacks (flamegraph.pl / speedscope) and replies with top self-time functions.
+    """
+    import io
+    import html
+    from utils import sampler
+
+    try:
+        seconds = min(120.0, max(1.0, float(args[0]))) if args else 10.0
+    except ValueError:
+        await event.reply("❌ Usage: <code>.profile [seconds]</code>", parse_mode="html")
+        return
+
+    logger.info(f"[profile] 🔥 Sampling for {seconds:.0f}s")
+    await event.reply(f"🔥 Profiling for {seconds:.0f}s…")
+    stacks, self_time, ticks, idle = await asyncio.to_thread(sampler.sample, seconds)
+
+    report_file = io.BytesIO(sampler.collapsed(stacks).encode("utf-8"))
+    report_file.name = "profile.collapsed"
+    # Cut whole lines before escaping so the caption never ends inside an HTML entity
+    lines, size = [], 0
+    for line in sampler.top_self(self_time).splitlines():
+        size += len(html.escape(line)) + 1
+        if size > 900:
+            break
+        lines.append(line)
+    summary = html.escape("\n".join(lines)) or "(all threads idle)"
+    await client.send_file(
+        event.chat_id, report_file,
+        caption=f"🔥 {ticks} ticks over {seconds:.0f}s, {idle} idle samples skipped\n\n<code>{summary}</code>",
+        parse_mode="html",
+    )
+
+@command(".events")
+async def handle_events(event, *args):
+    """
+    Show latest structured events from events.jsonl.
+    Usage:
+      .events              -> latest event per task
+      .events feed_frog    -> last 10 events of one task
+      .events feed_frog 25 -> last 25 events of one task
+    """
+    import html
+
+    def _line(r):
+        extra = {k: v for k, v in r.items() if k not in ("ts", "type", "task_id")}
+        return f"{clock.fmt(r['ts'])} {r.get('task_id', '—')} {r['type']} {json.dumps(extra, ensure_ascii=False)}"
+
+    if args:
+        limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        records = await asyncio.to_thread(eventlog.recent, args[0], limit)
+        title = f"📈 Last {len(records)} events for {args[0]}"
+    else:
+        records = list((await asyncio.to_thread(eventlog.latest_by_task)).values())
+        title = "📈 Latest event per task"
+
+    if not records:
+        await event.reply("📭 No events recorded.")
+        return
+
+    # Newest lines win; cut whole lines before escaping so no HTML entity is split
+    lines, size = [], 0
+    for r in reversed(records):
+        line = html.escape(_line(r))
+        size += len(line) + 1
+        if size > 3800:
+            break
+        lines.append(line)
+    payload = "\n".join(reversed(lines))
+    await event.reply(f"{title}:\n\n<code>{payload}</code>", parse_mode="html")
+
+@command(".exportevents")
+async def handle_export_events(event):
+    import tempfile
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "events.columns.json.gz"
+        rows = await asyncio.to_thread(eventlog.export_columnar, path)
+        await client.send_file(event.chat_id, str(path), caption=f"📦 {rows} events (columnar, gzip)")
+    logger.info(f"📤 Sent {rows} events via .exportevents")
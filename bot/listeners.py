@@ -0,0 +1,28 @@
+from telethon import events
+
+from .client import client
+from .config import TARGET_CHAT_ID, TARGET_SENDER_ID
+from .scheduler import leader, task_runner_work
+from utils.logger import logger
+
+
+@client.on(events.NewMessage(chats=TARGET_CHAT_ID, outgoing=True))
+async def track_own_cycle_message(event):
+    """Record our work-cycle commands; a scheduled 'end work' gets a new id when delivered."""
+    if task_runner_work.is_cycle_text(event.raw_text or ""):
+        task_runner_work.remember_own_message(event.id, event.raw_text)
+
+@client.on(events.NewMessage(chats=TARGET_CHAT_ID, from_users=TARGET_SENDER_ID))
+async def handle_target_reply(event):
+    """Drive the work cycle from what the target bot actually replies."""
+    if not leader.is_leader() or not event.is_reply:
+        return
+    # The bot answers every player and every command (feeding too); only replies to
+    # our own start/end messages count. Known ids only, no fetch per bot message.
+    if not task_runner_work.is_own_cycle_message(event.reply_to_msg_id):
+        return
+    text = event.raw_text or ""
+    try:
+        await task_runner_work.apply_bot_reply(text)
+    except Exception as e:
+        logger.error(f"[WORK_CYCLE_REPLY] ❌ Failed to apply bot reply: {e}")
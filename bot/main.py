@@ -1,15 +1,22 @@
 import asyncio
-from .scheduler import manager
+from .scheduler import manager, leader
 from .client import client
-from . import handlers
+from . import handlers, listeners, rules, control
 from utils.logger import logger  
+from utils import eventlog
 
 async def main():
+    # Up before client.start() so local control works even while Telegram is unreachable
+    control_server = asyncio.create_task(control.serve())
+
     await client.start()
     logger.info("✅ Userbot is running...")
 
     await asyncio.gather(
         client.run_until_disconnected(),
+        leader.run(),
+        eventlog.run_flusher(),
+        control_server,
         manager.start_all_tasks()
     )
 
@@ -0,0 +1,303 @@
+"""
+Auto-reply / trigger rules for incoming messages.
+
+rules.json (project root) holds a list of rules:
+  {
+    "id": "greet",
+    "keywords": ["привет", "hello"],      # literal, case-insensitive substrings
+    "regex": "^!price\\s+\\w+",           # optional, case-insensitive
+    "chats": [-1001433535272],            # optional chat_id filter
+    "senders": [123456789],               # optional sender_id filter
+    "action": {"type": "reply", "text": "👋"}
+  }
+Actions:
+  {"type": "reply", "text": "..."}
+  {"type": "command", "command": ".ping"}                       # any COMMAND_HANDLERS entry
+  {"type": "schedule", "text": "...", "delay_minutes": 5, "chat_id": ...}  # chat_id defaults to source chat
+A rule fires when all of its filters pass and any of its keywords/regex match
+(a rule with neither fires on every message that passes the filters).
+
+All keywords, plus a required literal pulled out of each regex (e.g. "!price" from
+"^!price\\s+\\w+"), go into one Aho-Corasick automaton. One pass over the message finds
+the keyword hits and the few regex rules worth running; only those run their own
+compiled pattern. Per-message cost depends on message length and actual hits, not on
+rule count. Regexes with no usable literal (".*", "\\d+") run on every message and
+are counted in the load log, so keep them rare.
+"""
+import json
+import re
+import time
+from re import _constants as sre, _parser as sre_parse
+from collections import Counter, deque
+from datetime import timedelta
+from pathlib import Path
+
+from telethon import events
+
+from .client import client
+from .scheduler import leader
+from utils.logger import logger
+
+BASE_DIR = Path(__file__).parent.parent
+RULES_FILE = BASE_DIR / "rules.json"
+
+ACTION_TYPES = {"reply", "command", "schedule"}
+
+# Shorter required literals match too often to be worth prefiltering on
+MIN_LITERAL_LEN = 3
+_REPEATS = (sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT)
+
+
+class _AhoCorasick:
+    """Multi-literal matcher: one pass over the text finds every keyword."""
+
+    def __init__(self, words: dict[str, set[int]]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[frozenset[int] | set[int]] = [set()]
+
+        for word, ids in words.items():
+            node = 0
+            for ch in word:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[node][ch] = nxt
+                node = nxt
+            self.out[node] |= ids
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+        self.out = [frozenset(o) for o in self.out]
+
+    def search(self, text: str) -> set[int]:
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        found: set[int] = set()
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+def _flatten(items):
+    """Parsed regex items with plain groups inlined (a group's content is matched exactly once)."""
+    for op, av in items:
+        if op is sre.SUBPATTERN:
+            yield from _flatten(av[-1])
+        else:
+            yield op, av
+
+def _required(items) -> set[str] | None:
+    """
+    Lowercased literals such that every match contains at least one of them,
+    or None when the pattern guarantees none (then it must always run).
+    """
+    best: set[str] | None = None
+    run: list[str] = []
+
+    def consider(option):
+        nonlocal best
+        if option and (best is None or min(map(len, option)) > min(map(len, best))):
+            best = option
+
+    for op, av in _flatten(items):
+        if op is sre.LITERAL:
+            run.append(chr(av))
+            continue
+        consider({"".join(run).lower()} if run else None)
+        run = []
+        if op is sre.BRANCH:
+            alternatives = [_required(branch) for branch in av[1]]
+            if all(alternatives):
+                consider(set().union(*alternatives))
+        elif op in _REPEATS and av[0] >= 1:
+            consider(_required(av[2]))
+    consider({"".join(run).lower()} if run else None)
+    return best
+
+def required_literals(pattern: str) -> set[str] | None:
+    try:
+        literals = _required(sre_parse.parse(pattern, re.I))
+    except Exception:
+        return None
+    if not literals or min(map(len, literals)) < MIN_LITERAL_LEN:
+        return None
+    return literals
+
+
+class RuleEngine:
+    def __init__(self, rules: list[dict]):
+        self.rules = rules
+        self.fires: Counter[str] = Counter()
+        self.match_count = 0
+        self.match_time_total = 0.0
+        self.match_time_max = 0.0
+
+        # Rules without keywords/regex fire on filters alone
+        self.always: set[int] = set()
+
+        # Automaton outputs: idx for a keyword hit, ~idx for "regex rule idx may match"
+        words: dict[str, set[int]] = {}
+        any_chat: set[int] = set()
+        bound: dict[int, set[int]] = {}
+        self.regexes: dict[int, re.Pattern] = {}
+        # Regexes without a required literal: checked on every message
+        self.unfiltered: list[int] = []
+
+        for idx, rule in enumerate(rules):
+            chats = rule.get("chats")
+            if chats:
+                for chat_id in chats:
+                    bound.setdefault(int(chat_id), set()).add(idx)
+            else:
+                any_chat.add(idx)
+
+            keywords = [k.lower() for k in rule.get("keywords") or [] if k]
+            for k in keywords:
+                words.setdefault(k, set()).add(idx)
+
+            pattern = rule.get("regex")
+            if pattern:
+                self.regexes[idx] = re.compile(pattern, re.I)
+                literals = required_literals(pattern)
+                if literals:
+                    for lit in literals:
+                        words.setdefault(lit, set()).add(~idx)
+                else:
+                    self.unfiltered.append(idx)
+
+            if not keywords and not pattern:
+                self.always.add(idx)
+
+        # Chat pre-filter: rules for any chat, and per bound chat the full candidate set
+        # (bound + any-chat rules), merged once here instead of on every message
+        self.any_chat: frozenset[int] = frozenset(any_chat)
+        self.by_chat: dict[int, frozenset[int]] = {chat_id: frozenset(ids | any_chat) for chat_id, ids in bound.items()}
+        self.automaton = _AhoCorasick(words) if words else None
+        if self.unfiltered:
+            logger.warning(f"[RULES_LOAD] ⚠️ {len(self.unfiltered)} regex rules have no literal to prefilter on "
+                           f"and run on every message: "
+                           + ", ".join(str(rules[i]["id"]) for i in self.unfiltered[:10]))
+
+    def candidates(self, chat_id: int | None) -> frozenset[int]:
+        return self.by_chat.get(chat_id, self.any_chat)
+
+    def match(self, text: str, chat_id: int | None, sender_id: int | None) -> list[dict]:
+        """Return the rules that fire for this message, in config order."""
+        started = time.perf_counter()
+
+        matched: set[int] = set()
+        candidates = self.candidates(chat_id)
+        if candidates:
+            matched |= self.always
+            to_check = [idx for idx in self.unfiltered if idx in candidates]
+            if self.automaton:
+                for hit in self.automaton.search(text.lower()):
+                    if hit >= 0:
+                        matched.add(hit)
+                    elif ~hit in candidates:
+                        to_check.append(~hit)
+            matched.update(idx for idx in to_check if self.regexes[idx].search(text))
+            matched &= candidates
+
+        fired = []
+        for idx in sorted(matched):
+            rule = self.rules[idx]
+            senders = rule.get("senders")
+            if senders and sender_id not in senders:
+                continue
+            fired.append(rule)
+            self.fires[rule["id"]] += 1
+
+        elapsed = time.perf_counter() - started
+        self.match_count += 1
+        self.match_time_total += elapsed
+        self.match_time_max = max(self.match_time_max, elapsed)
+        return fired
+
+
+def _validate(rules) -> list[dict]:
+    if not isinstance(rules, list):
+        raise ValueError("rules.json must contain a list of rules")
+    valid = []
+    for i, rule in enumerate(rules):
+        rule.setdefault("id", f"rule_{i}")
+        action = rule.get("action") or {}
+        if action.get("type") not in ACTION_TYPES:
+            logger.warning(f"[RULES_LOAD] ⚠️ Rule {rule['id']} has unknown action {action!r}, skipped")
+            continue
+        if rule.get("regex"):
+            try:
+                re.compile(rule["regex"], re.I)
+            except re.error as e:
+                logger.warning(f"[RULES_LOAD] ⚠️ Rule {rule['id']} has invalid regex: {e}, skipped")
+                continue
+        valid.append(rule)
+    return valid
+
+def load_rules() -> RuleEngine:
+    """(Re)build the engine from rules.json. Missing file -> empty engine."""
+    global engine
+    rules = []
+    if RULES_FILE.exists():
+        try:
+            with RULES_FILE.open("r", encoding="utf-8") as f:
+                rules = _validate(json.load(f))
+            engine = RuleEngine(rules)
+        except Exception as e:
+            logger.error(f"[RULES_LOAD] ❌ Failed to load {RULES_FILE}: {e}")
+            rules = []
+    if not rules:
+        engine = RuleEngine([])
+    logger.info(f"[RULES_LOAD] Loaded {len(rules)} rules")
+    return engine
+
+engine = load_rules()
+
+
+async def _run_action(event, rule: dict):
+    action = rule["action"]
+    kind = action["type"]
+    if kind == "reply":
+        await event.reply(action["text"])
+    elif kind == "command":
+        from .handlers import COMMAND_HANDLERS
+
+        parts = action["command"].split()
+        handler = COMMAND_HANDLERS.get(parts[0].lower())
+        if handler is None:
+            logger.warning(f"[RULES_FIRE] ⚠️ Rule {rule['id']}: unknown command {parts[0]}")
+            return
+        await handler(event, *parts[1:])
+    elif kind == "schedule":
+        chat_id = action.get("chat_id", event.chat_id)
+        delay = timedelta(minutes=float(action.get("delay_minutes", 1)))
+        await client.send_message(chat_id, action["text"], schedule=delay)
+
+@client.on(events.NewMessage(incoming=True))
+async def handle_incoming(event):
+    if not engine.rules or not leader.is_leader():
+        return
+    fired = engine.match(event.raw_text or "", event.chat_id, event.sender_id)
+    for rule in fired:
+        logger.info(f"[RULES_FIRE] {rule['id']} in chat {event.chat_id}")
+        try:
+            await _run_action(event, rule)
+        except Exception as e:
+            logger.error(f"[RULES_FIRE] ❌ Rule {rule['id']} action failed: {e}")
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime, timezone
+
+# Legacy on-disk format (schema v1) — only used for migration and display
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def now() -> float:
+    """Current wall-clock time as a UTC epoch timestamp (timezone independent)."""
+    return time.time()
+
+def monotonic() -> float:
+    """Monotonic clock for measuring durations; never jumps with NTP/DST."""
+    return time.monotonic()
+
+def to_ts(dt: datetime | None) -> float | None:
+    """
+    Convert a datetime to an epoch timestamp.
+    Aware datetimes (e.g. Telethon's msg.date, which is UTC) are converted exactly,
+    naive ones are treated as local time.
+    """
+    if dt is None:
+        return None
+    return dt.timestamp()
+
+def parse_local(s: str) -> float:
+    """Parse a user-entered local "YYYY-MM-DD HH:MM:SS" into an epoch timestamp (ValueError if malformed)."""
+    return datetime.strptime(s, TIME_FMT).timestamp()
+
+def parse_legacy(s, utc: bool = False) -> float | None:
+    """Parse a schema v1 naive time string (local time, or UTC if utc=True) into an epoch timestamp."""
+    if not s:
+        return None
+    if isinstance(s, (int, float)):
+        return float(s)
+    try:
+        dt = datetime.strptime(s, TIME_FMT)
+    except (TypeError, ValueError):
+        return None
+    if utc:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def seconds_until(ts: float | None) -> int:
+    if ts is None:
+        return 0
+    return max(0, int(ts - now()))
+
+def fmt(ts: float | None, default: str | None = None) -> str | None:
+    """Human-readable local time; only for replies and log lines."""
+    if ts is None:
+        return default
+    return datetime.fromtimestamp(ts).strftime(TIME_FMT)
+
+def fmt_duration(seconds: float) -> str:
+    m, _ = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}h {m}m"
@@ -0,0 +1,178 @@
+import asyncio
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.logger import logger
+from utils import eventlog
+from . import clock
+from .storage import load_state, save_state
+from ..config import LEADER_LOCK_DIR, INSTANCE_ID, LEADER_LEASE_SEC
+
+# Leader renews (and standby retries) this often; takeover happens within LEASE + RENEW_EVERY
+RENEW_EVERY = max(1.0, LEADER_LEASE_SEC / 3)
+
+# state.json key holding the newest fencing token; a leader with a lower token is stale
+FENCE_KEY = "_fencing_token"
+
+ENABLED = bool(LEADER_LOCK_DIR)
+
+_token: int | None = None
+_lease_expires_at = 0.0
+_is_leader = not ENABLED
+
+_acquired = asyncio.Event()
+_lost = asyncio.Event()
+if _is_leader:
+    _acquired.set()
+
+
+def _lease_path() -> Path:
+    return Path(LEADER_LOCK_DIR) / "leader.lock"
+
+@contextmanager
+def _mutex():
+    """Serialize read-modify-write of the lease between instances."""
+    path = Path(LEADER_LOCK_DIR) / "leader.mutex"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_lease() -> dict | None:
+    try:
+        with _lease_path().open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _write_lease(lease: dict):
+    tmp = _lease_path().with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(lease, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _lease_path())
+
+def _try_acquire_or_renew() -> int | None:
+    """Take or extend the lease. Returns our fencing token, or None if someone else holds it."""
+    with _mutex():
+        lease = _read_lease()
+        now = clock.now()
+        if lease and lease.get("holder") != INSTANCE_ID and lease.get("expires_at", 0) > now:
+            return None
+        if lease and lease.get("holder") == INSTANCE_ID and lease.get("token") == _token:
+            token = _token
+        else:
+            token = int((lease or {}).get("token", 0)) + 1
+        _write_lease({"holder": INSTANCE_ID, "token": token, "expires_at": now + LEADER_LEASE_SEC})
+        return token
+
+def _release():
+    with _mutex():
+        lease = _read_lease()
+        if lease and lease.get("holder") == INSTANCE_ID:
+            lease["expires_at"] = 0
+            _write_lease(lease)
+
+
+def _become_leader(token: int):
+    global _is_leader, _token
+    _token = token
+    _is_leader = True
+
+    state = load_state()
+    if state.get(FENCE_KEY, 0) < token:
+        state[FENCE_KEY] = token
+        save_state(state)
+
+    _lost.clear()
+    _acquired.set()
+    logger.info(f"[LEADER] 👑 {INSTANCE_ID} is now leader (token={token})")
+    eventlog.emit("leader_acquired", instance=INSTANCE_ID, token=token)
+
+def _step_down(reason: str):
+    global _is_leader
+    if not _is_leader:
+        return
+    _is_leader = False
+    _acquired.clear()
+    _lost.set()
+    logger.warning(f"[LEADER] ⬇️ {INSTANCE_ID} stepped down: {reason}")
+    eventlog.emit("leader_lost", instance=INSTANCE_ID, token=_token, reason=reason)
+
+
+def is_leader() -> bool:
+    return _is_leader
+
+def role() -> dict:
+    return {
+        "enabled": ENABLED,
+        "instance": INSTANCE_ID,
+        "leader": _is_leader,
+        "token": _token,
+        "lease_expires_at": _lease_expires_at if ENABLED else None,
+    }
+
+def check_fence() -> bool:
+    """
+    Call right before any send. False means this instance must not send:
+    it's standby, its lease ran out locally, or a newer leader has fenced it off.
+    """
+    if not ENABLED:
+        return True
+    if not _is_leader:
+        return False
+    if clock.now() >= _lease_expires_at:
+        _step_down("lease expired before renewal")
+        return False
+    lease = _read_lease()
+    if not lease or lease.get("token") != _token:
+        _step_down("lease file holds a different token")
+        return False
+    if load_state().get(FENCE_KEY, 0) > _token:
+        _step_down("newer fencing token in state")
+        return False
+    return True
+
+async def wait_for_leadership():
+    await _acquired.wait()
+
+async def wait_for_loss():
+    await _lost.wait()
+
+async def release():
+    """Give up the lease on clean shutdown so the standby takes over immediately."""
+    if ENABLED and _is_leader:
+        await asyncio.to_thread(_release)
+        _step_down("released")
+
+async def run():
+    """Lease loop: the leader renews, the standby keeps trying to take over."""
+    global _lease_expires_at
+    if not ENABLED:
+        return
+    logger.info(f"[LEADER] Election enabled for {INSTANCE_ID} (lock dir {LEADER_LOCK_DIR}, lease {LEADER_LEASE_SEC}s)")
+
+    while True:
+        attempt_at = clock.now()
+        try:
+            token = await asyncio.to_thread(_try_acquire_or_renew)
+        except Exception as e:
+            logger.error(f"[LEADER] ❌ lease update failed: {e}")
+            token = None
+
+        if token is not None:
+            # Conservative: count the lease from before the write
+            _lease_expires_at = attempt_at + LEADER_LEASE_SEC
+            if not _is_leader:
+                _become_leader(token)
+        elif _is_leader:
+            _step_down("lease held by another instance")
+
+        await asyncio.sleep(RENEW_EVERY)
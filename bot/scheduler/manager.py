@@ -1,16 +1,100 @@
 import asyncio
 import json
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 
+from . import clock, leader, outbox
 from .task_runner import run_task
 from .task_runner_work import run_chain_task
+from .task_runner_broadcast import run_broadcast_task
+from .task_runner_horizon import run_horizon_task
 from .storage import load_state
+from utils import eventlog
 
 logger = logging.getLogger("userbot")
 
 BASE_DIR = Path(__file__).parent.parent.parent
 
+# Restart policy for crashed task coroutines
+RESTART_BASE_DELAY = 5      # first backoff, doubled on each consecutive crash
+RESTART_MAX_DELAY = 600     # backoff cap
+RESTART_BUDGET = 5          # consecutive crashes allowed before giving up
+STABLE_AFTER = 900          # a run this long resets the consecutive-crash counter
+
+
+@dataclass
+class TaskStatus:
+    task_id: str
+    status: str = "pending"         # pending | running | backoff | failed | finished
+    started_at: float | None = None # monotonic start of the current run
+    restarts: int = 0
+    consecutive_failures: int = 0
+    last_error: str | None = None
+    last_error_at: float | None = None  # epoch
+
+    def uptime(self) -> float:
+        if self.status != "running" or self.started_at is None:
+            return 0.0
+        return clock.monotonic() - self.started_at
+
+
+# task_id -> TaskStatus, read by the .tasks command
+SUPERVISED: dict[str, TaskStatus] = {}
+
+
+async def supervise(task_id: str, factory):
+    """
+    Run factory() under a watcher: a crash is logged and the task is restarted
+    with exponential backoff until it exhausts RESTART_BUDGET consecutive failures.
+    Crashes never propagate, so one bad task can't stop the others.
+    """
+    info = SUPERVISED.setdefault(task_id, TaskStatus(task_id))
+
+    while True:
+        info.status = "running"
+        info.started_at = clock.monotonic()
+        try:
+            await factory()
+            info.status = "finished"
+            logger.info(f"[SUPERVISOR] {task_id} finished")
+            return
+        except asyncio.CancelledError:
+            info.status = "finished"
+            raise
+        except Exception as e:
+            ran_for = clock.monotonic() - info.started_at
+            if ran_for >= STABLE_AFTER:
+                info.consecutive_failures = 0
+            info.consecutive_failures += 1
+            info.last_error = f"{type(e).__name__}: {e}"
+            info.last_error_at = clock.now()
+            logger.exception(f"[SUPERVISOR] ❌ {task_id} crashed after {int(ran_for)}s: {info.last_error}")
+            eventlog.emit("task_crash", task_id=task_id, duration=ran_for, error=info.last_error)
+
+            if info.consecutive_failures > RESTART_BUDGET:
+                info.status = "failed"
+                eventlog.emit("task_failed", task_id=task_id, restarts=info.restarts)
+                logger.error(f"[SUPERVISOR] 🛑 {task_id} exceeded restart budget "
+                             f"({RESTART_BUDGET}), giving up")
+                return
+
+            delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * 2 ** (info.consecutive_failures - 1))
+            info.status = "backoff"
+            logger.warning(f"[SUPERVISOR] 🔁 restarting {task_id} in {delay}s "
+                           f"(attempt {info.consecutive_failures}/{RESTART_BUDGET})")
+            await asyncio.sleep(delay)
+            info.restarts += 1
+            eventlog.emit("task_restart", task_id=task_id, restarts=info.restarts)
+
+            # The crash may have hit between a send and its state save; startup replay
+            # ran long ago, so reconcile this task's intents before it resumes sending
+            try:
+                await outbox.replay(task_id)
+            except Exception as e:
+                logger.error(f"[OUTBOX] ❌ replay for {task_id} failed: {e}")
+
+
 async def start_all_tasks():
     logger.info("🛠 Starting all scheduled tasks…")
 
@@ -21,15 +105,59 @@ async def start_all_tasks():
     except FileNotFoundError:
         logger.error(f"❌ Cannot find tasks.json at {tasks_config_path}")
         return
+    except json.JSONDecodeError as e:
+        logger.error(f"❌ tasks.json is not valid JSON: {e}")
+        return
+
+    while True:
+        if not leader.is_leader():
+            logger.info("[LEADER] 💤 Standby: waiting for leadership before scheduling")
+            await leader.wait_for_leadership()
+
+        scheduler = asyncio.create_task(_run_tasks(tasks_config))
+        lost = asyncio.create_task(leader.wait_for_loss())
+        done, _ = await asyncio.wait({scheduler, lost}, return_when=asyncio.FIRST_COMPLETED)
+
+        if scheduler in done:
+            lost.cancel()
+            return
+
+        # Leadership lost: stop sending, go back to warm standby
+        scheduler.cancel()
+        await asyncio.gather(scheduler, return_exceptions=True)
+        logger.warning("[LEADER] Scheduler stopped after losing leadership")
+
+async def _run_tasks(tasks_config: dict):
+    # Reconcile sends interrupted by a crash before any runner starts sending again
+    try:
+        await outbox.replay()
+    except Exception as e:
+        logger.error(f"[OUTBOX] ❌ replay failed: {e}")
 
     state = load_state()
 
-    tasks = [
-        run_task(task_id, task_conf, state)
-        for task_id, task_conf in tasks_config.items()
-    ]
+    runners = {
+        "message": run_task,
+        "horizon": run_horizon_task,
+        "broadcast": run_broadcast_task,
+    }
+
+    tasks = []
+    for task_id, task_conf in tasks_config.items():
+        kind = task_conf.get("type", "message")
+        # Message tasks with a booking horizon pre-schedule instead of polling
+        if kind == "message" and task_conf.get("horizon_hours"):
+            kind = "horizon"
+        runner = runners.get(kind)
+        if runner is None:
+            logger.error(f"❌ Task {task_id} has unknown type {task_conf.get('type')!r}, skipped")
+            continue
+        tasks.append(supervise(
+            task_id,
+            lambda runner=runner, task_id=task_id, task_conf=task_conf: runner(task_id, task_conf, state),
+        ))
 
     # work_cycle
-    tasks.append(run_chain_task())
+    tasks.append(supervise("work_cycle", run_chain_task))
 
-    await asyncio.gather(*tasks)
\ No newline at end of file
+    await asyncio.gather(*tasks, return_exceptions=True)
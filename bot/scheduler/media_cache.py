@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+from pathlib import Path
+
+from telethon.errors import FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+from telethon.tl.types import (
+    DocumentAttributeSticker, InputDocument, InputFileBig, InputMediaUploadedPhoto, InputPhoto,
+    InputStickerSetEmpty, MessageMediaDocument, MessageMediaPhoto,
+)
+
+from ..client import client
+from utils.logger import logger
+from . import clock
+
+CACHE_FILE = "media_cache.json"
+
+CACHE_TTL_SEC = 7 * 24 * 3600        # re-upload after a week even if never rejected
+BIG_FILE_THRESHOLD = 10 * 1024 ** 2  # Telegram "big file" upload path above 10 MiB
+PART_SIZE = 512 * 1024               # max part size for SaveBigFilePart
+UPLOAD_WORKERS = 4                   # parallel parts in flight
+
+# Server rejected a cached reference -> drop it and upload again
+STALE_ERRORS = (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError)
+
+# path -> (size, mtime_ns, sha256): skip re-hashing unchanged files
+_hash_memo: dict[str, tuple[int, int, str]] = {}
+# cache key -> lock, so concurrent sends of the same new file upload it only once
+_upload_locks: dict[str, asyncio.Lock] = {}
+
+
+def _load() -> dict:
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return {}
+
+def _save(cache: dict):
+    # Expired entries are never reused; prune them so the file doesn't grow forever
+    now = clock.now()
+    cache = {k: ref for k, ref in cache.items() if now - ref.get("cached_at", 0) < CACHE_TTL_SEC}
+    tmp = CACHE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, CACHE_FILE)
+
+def _sha256(path: str) -> str:
+    st = os.stat(path)
+    memo = _hash_memo.get(path)
+    if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+        return memo[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _hash_memo[path] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
+
+def _ref_from_media(media) -> dict | None:
+    """Serializable server-side handle of a sent photo/document."""
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        obj, kind = media.photo, "photo"
+    elif isinstance(media, MessageMediaDocument) and media.document:
+        obj, kind = media.document, "document"
+    else:
+        return None
+    return {
+        "kind": kind,
+        "id": obj.id,
+        "access_hash": obj.access_hash,
+        "file_reference": obj.file_reference.hex(),
+        "cached_at": clock.now(),
+    }
+
+def _input_from_ref(ref: dict):
+    cls = InputPhoto if ref["kind"] == "photo" else InputDocument
+    return cls(id=ref["id"], access_hash=ref["access_hash"], file_reference=bytes.fromhex(ref["file_reference"]))
+
+def _drop(key: str):
+    cache = _load()
+    if cache.pop(key, None) is not None:
+        _save(cache)
+
+
+async def _upload_parallel(path: str, size: int) -> InputFileBig:
+    """Upload a big file with UPLOAD_WORKERS parts in flight instead of one at a time."""
+    file_id = random.getrandbits(63)
+    total_parts = (size + PART_SIZE - 1) // PART_SIZE
+    parts = asyncio.Queue()
+    for i in range(total_parts):
+        parts.put_nowait(i)
+
+    def _read(index: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(index * PART_SIZE)
+            return f.read(PART_SIZE)
+
+    async def _worker():
+        while not parts.empty():
+            index = parts.get_nowait()
+            data = await asyncio.to_thread(_read, index)
+            await client(SaveBigFilePartRequest(file_id, index, total_parts, data))
+
+    started = clock.monotonic()
+    await asyncio.gather(*(_worker() for _ in range(min(UPLOAD_WORKERS, total_parts))))
+    logger.info(f"[MEDIA] ⬆️ uploaded {Path(path).name} ({size / 1024 ** 2:.1f} MiB, "
+                f"{total_parts} parts) in {clock.monotonic() - started:.1f}s")
+    return InputFileBig(file_id, total_parts, Path(path).name)
+
+async def _upload(path: str):
+    size = os.path.getsize(path)
+    if size > BIG_FILE_THRESHOLD:
+        return await _upload_parallel(path, size)
+    return await client.upload_file(path)
+
+
+def sent_text(task_conf: dict) -> str:
+    """
+    Text the delivered message will actually carry (msg.message), for outbox intents
+    and history matching: stickers are sent without their caption.
+    """
+    if task_conf.get("file") and task_conf.get("file_type") == "sticker":
+        return ""
+    return task_conf.get("message", "")
+
+def _send_kwargs(kind: str | None, caption: str | None, kwargs: dict) -> dict:
+    send_kw = dict(caption=caption or "", force_document=(kind == "document"), **kwargs)
+    if kind == "sticker":
+        # Stickers carry no caption; the attribute makes Telegram render it as a sticker
+        send_kw["caption"] = ""
+        send_kw["attributes"] = [DocumentAttributeSticker(alt="", stickerset=InputStickerSetEmpty())]
+    return send_kw
+
+async def send_media(chat_id: int, path: str, caption: str | None = None,
+                     kind: str | None = None, **kwargs):
+    """
+    Send a photo/sticker/document, reusing the server-side file if these exact bytes
+    were sent the same way before (keyed by sha256 + kind, valid for CACHE_TTL_SEC).
+      kind: "photo"    -> compressed photo, whatever the file extension
+            "sticker"  -> sticker (.webp/.tgs/.webm), caption dropped
+            "document" -> uncompressed file
+            None       -> Telethon decides by extension
+      kwargs: passed to send_file (e.g. schedule=timedelta(...))
+    """
+    digest = await asyncio.to_thread(_sha256, path)
+    key = f"{digest}:{kind or 'auto'}"
+    send_kw = _send_kwargs(kind, caption, kwargs)
+
+    msg = await _send_cached(chat_id, path, key, send_kw)
+    if msg is not None:
+        return msg
+
+    async with _upload_locks.setdefault(key, asyncio.Lock()):
+        # Another sender may have uploaded these bytes while we waited
+        msg = await _send_cached(chat_id, path, key, send_kw)
+        if msg is not None:
+            return msg
+
+        uploaded = await _upload(path)
+        media = InputMediaUploadedPhoto(file=uploaded) if kind == "photo" else uploaded
+        msg = await client.send_file(chat_id, media, **send_kw)
+
+        new_ref = _ref_from_media(getattr(msg, "media", None))
+        if new_ref:
+            cache = _load()
+            cache[key] = new_ref
+            _save(cache)
+        return msg
+
+async def _send_cached(chat_id: int, path: str, key: str, send_kw: dict):
+    """Send via the cached server-side file. None on miss, expiry or a rejected reference."""
+    ref = _load().get(key)
+    if not ref or clock.now() - ref.get("cached_at", 0) >= CACHE_TTL_SEC:
+        return None
+    try:
+        msg = await client.send_file(chat_id, _input_from_ref(ref), **send_kw)
+        logger.debug(f"[MEDIA] ♻️ reused cached upload for {Path(path).name}")
+        return msg
+    except STALE_ERRORS as e:
+        logger.info(f"[MEDIA] cached reference for {Path(path).name} rejected ({type(e).__name__}), re-uploading")
+        _drop(key)
+        return None
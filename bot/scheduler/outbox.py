@@ -0,0 +1,152 @@
+import json
+import os
+from collections import defaultdict
+
+from telethon.tl.functions.messages import GetScheduledHistoryRequest
+
+from ..client import client
+from utils.logger import logger
+from utils import eventlog
+from . import clock
+from ..config import STATE_DIR
+
+OUTBOX_FILE = os.path.join(STATE_DIR, "outbox.json")
+
+# How far a message date may be from the planned time and still count as "ours"
+MATCH_WINDOW_SEC = 300
+# Recent own messages scanned per chat during replay
+REPLAY_HISTORY_LIMIT = 50
+
+# Intents resolved by replay(), waiting for their runner to adopt them: task_id -> [record]
+_recovered: dict[str, list[dict]] = defaultdict(list)
+
+
+def _load() -> dict:
+    if not os.path.exists(OUTBOX_FILE):
+        return {}
+    try:
+        with open(OUTBOX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        logger.error(f"[OUTBOX] ❌ {OUTBOX_FILE} is corrupt, starting empty")
+        return {}
+
+def _save(records: dict):
+    tmp = OUTBOX_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, OUTBOX_FILE)
+
+
+def intent(task_id: str, chat_id: int, text: str, planned_at: float) -> str:
+    """Durably record a send we're about to make. Must be called BEFORE the send."""
+    key = f"{task_id}:{int(planned_at * 1000)}"
+    records = _load()
+    records[key] = {
+        "key": key,
+        "task_id": task_id,
+        "chat_id": chat_id,
+        "text": text,
+        "planned_at": planned_at,
+        "created_at": clock.now(),
+        "msg_id": None,
+    }
+    _save(records)
+    return key
+
+def link(key: str, msg_id: int):
+    """Attach the message id Telegram returned to its intent."""
+    records = _load()
+    if key in records:
+        records[key]["msg_id"] = msg_id
+        _save(records)
+
+def done(key: str):
+    """Drop the intent once the runner has persisted the message id in state."""
+    records = _load()
+    if records.pop(key, None) is not None:
+        _save(records)
+
+def take(task_id: str) -> list[dict]:
+    """
+    Recovered sends for task_id (oldest first); each is returned once.
+    The caller adopts them into its state and then calls done(record["key"]).
+    """
+    return sorted(_recovered.pop(task_id, []), key=lambda r: r["planned_at"])
+
+
+def _match(record: dict, messages: list, used: set) -> int | None:
+    for msg in messages:
+        if msg.id in used or getattr(msg, "message", None) != record["text"] or not msg.date:
+            continue
+        if abs(clock.to_ts(msg.date) - record["planned_at"]) <= MATCH_WINDOW_SEC:
+            used.add(msg.id)
+            return msg.id
+    return None
+
+async def replay(task_id: str | None = None):
+    """
+    Resolve intents left by a crash between send and state save.
+    One pass per chat: fetch the scheduled queue and recent own history once,
+    match every unresolved intent by text + planned time. Matches are queued for
+    take(); intents with no matching message were never sent and are dropped.
+    With task_id, only that task's intents are replayed (supervised restart of one task).
+    """
+    if task_id is None:
+        _recovered.clear()
+    else:
+        _recovered.pop(task_id, None)
+    records = _load()
+    if not records:
+        return
+
+    by_chat = defaultdict(list)
+    for key, rec in records.items():
+        if task_id is not None and rec["task_id"] != task_id:
+            continue
+        if rec.get("msg_id"):
+            _recovered[rec["task_id"]].append(rec)
+        else:
+            by_chat[rec["chat_id"]].append(rec)
+
+    # key -> matched msg_id, or None for an intent that was never sent
+    resolved: dict[str, int | None] = {}
+    for chat_id, pending in by_chat.items():
+        try:
+            scheduled = await client(GetScheduledHistoryRequest(peer=chat_id, hash=0))
+            messages = list(getattr(scheduled, "messages", []))
+            messages.extend(await client.get_messages(chat_id, limit=REPLAY_HISTORY_LIMIT, from_user="me"))
+        except Exception as e:
+            # Can't tell whether they went out; keep them for the next replay
+            logger.warning(f"[OUTBOX] ⚠️ replay fetch failed for chat {chat_id}: {e}; keeping intents")
+            continue
+
+        used: set[int] = set()
+        for rec in pending:
+            msg_id = _match(rec, messages, used)
+            resolved[rec["key"]] = msg_id
+            if msg_id:
+                rec["msg_id"] = msg_id
+                _recovered[rec["task_id"]].append(rec)
+                logger.info(f"[OUTBOX] 🔁 recovered {rec['key']} -> msg_id={msg_id}")
+                eventlog.emit("outbox_recovered", task_id=rec["task_id"], chat_id=chat_id,
+                              msg_id=msg_id, planned_ts=rec["planned_at"])
+            else:
+                logger.info(f"[OUTBOX] 🗑 {rec['key']} was never sent, dropping intent")
+                eventlog.emit("outbox_dropped", task_id=rec["task_id"], chat_id=chat_id,
+                              planned_ts=rec["planned_at"])
+
+    if not resolved:
+        return
+    # Other tasks keep writing intents while we await the fetches: re-read and touch only our keys
+    records = _load()
+    for key, msg_id in resolved.items():
+        if key not in records:
+            continue
+        if msg_id:
+            records[key]["msg_id"] = msg_id
+        else:
+            records.pop(key)
+    _save(records)
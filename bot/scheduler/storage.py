@@ -1,31 +1,81 @@
 import json
+import logging
 import os
-from datetime import datetime
 
-STATE_FILE = "state.json"
+from . import clock
+from ..config import STATE_DIR
+
+# Shared between hot-standby instances when STATE_DIR points at common storage
+os.makedirs(STATE_DIR, exist_ok=True)
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+
+# v1: timestamps stored as local "%Y-%m-%d %H:%M:%S" strings
+# v2: timestamps stored as UTC epoch floats
+SCHEMA_VERSION = 2
+SCHEMA_KEY = "_schema"
+
+# Task-state fields that hold timestamps
+TIME_KEYS = {"last_sent", "scheduled_send_at", "next_start_at", "scheduled_end_at", "last_end_at"}
+# v1 message tasks stored last_sent from msg.date (naive UTC); everything else,
+# including the work_cycle entry, was local time
+UTC_KEYS = {"last_sent"}
+
+logger = logging.getLogger("userbot")
+
+
+def _migrate(state: dict) -> bool:
+    """Upgrade state in place to SCHEMA_VERSION. Returns True if anything changed."""
+    version = state.get(SCHEMA_KEY, 1)
+    if version >= SCHEMA_VERSION:
+        return False
+
+    if version < 2:
+        for task_id, task_state in state.items():
+            if not isinstance(task_state, dict):
+                continue
+            for k in TIME_KEYS & task_state.keys():
+                task_state[k] = clock.parse_legacy(task_state[k], utc=k in UTC_KEYS and task_id != "work_cycle")
+        logger.info(f"[STATE_MIGRATE] Migrated state.json from schema v{version} to v2 (epoch timestamps)")
+
+    state[SCHEMA_KEY] = SCHEMA_VERSION
+    return True
 
 def load_state():
     if not os.path.exists(STATE_FILE):
-        return {}
+        return {SCHEMA_KEY: SCHEMA_VERSION}
     with open(STATE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+        state = json.load(f)
+    if _migrate(state):
+        save_state(state)
+    return state
 
 def save_state(state):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
+    state[SCHEMA_KEY] = SCHEMA_VERSION
+    # Write-then-rename so a crash never leaves a truncated state.json
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_FILE)
 
-def get_last_sent(task_id, state):
-    ts = state.get(task_id, {}).get("last_sent")
-    if ts:
-        return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-    return None
+def get_last_sent(task_id, state) -> float | None:
+    return state.get(task_id, {}).get("last_sent")
 
-def update_last_sent(task_id, state, when: datetime=None):
-    if task_id not in state:
-        state[task_id] = {}
+def update_task_state(task_id: str, **fields) -> dict:
+    """
+    Merge fields into state[task_id] of a freshly loaded state and save it.
+    Tasks run concurrently: saving a copy loaded before an await would wipe out
+    whatever other tasks persisted in the meantime.
+    """
+    state = load_state()
+    task_state = state.setdefault(task_id, {})
+    task_state.update(fields)
+    save_state(state)
+    return task_state
 
+def update_last_sent(task_id, state, when: float = None):
     if when is None:
-        when = datetime.now()
-
-    state[task_id]["last_sent"] = when.strftime("%Y-%m-%d %H:%M:%S")
-    save_state(state)
\ No newline at end of file
+        when = clock.now()
+    state.setdefault(task_id, {})["last_sent"] = when
+    update_task_state(task_id, last_sent=when)
@@ -1,11 +1,13 @@
 import asyncio
 import random
-from datetime import datetime, timedelta
+from datetime import timedelta
 from telethon.errors import MessageIdInvalidError
 
 from ..client import client
-from .storage import get_last_sent, update_last_sent, load_state, save_state
+from . import clock, leader, media_cache, outbox
+from .storage import get_last_sent, load_state, update_task_state
 from utils.logger import logger
+from utils import eventlog
 
 # Safe polling windows (to avoid frequent API hits)
 LONG_POLL  = 2400  # 40 min when far from event
@@ -18,28 +20,11 @@ DELETE_MIN_SEC = 90
 DELETE_MAX_SEC = 200
 
 
-def _now() -> datetime:
-    return datetime.now()
-
-def _fmt(dt: datetime | None) -> str | None:
-    return dt.strftime("%Y-%m-%d %H:%M:%S") if dt else None
-
-def _dt(s: str | None) -> datetime | None:
-    if not s:
-        return None
-    try:
-        return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
-    except Exception:
-        return None
-
-def _seconds_until(dt: datetime) -> int:
-    return max(0, int((dt - _now()).total_seconds()))
-
-def _choose_sleep(target_dt: datetime | None) -> int:
+def _choose_sleep(target_ts: float | None) -> int:
     """Adaptive backoff based on how far the next event is."""
-    if not target_dt:
+    if not target_ts:
         return LONG_POLL
-    sec = _seconds_until(target_dt)
+    sec = clock.seconds_until(target_ts)
     if sec > 3600:
         return LONG_POLL
     elif sec > 600:
@@ -55,12 +40,28 @@ async def _delete_message_after_delay(chat_id: int, msg_id: int):
     try:
         await client.delete_messages(chat_id, msg_id)
         logger.info(f"[{chat_id}] [AUTO_DELETE] message {msg_id} deleted after {delay}s")
+        eventlog.emit("message_deleted", chat_id=chat_id, msg_id=msg_id, duration=delay)
     except MessageIdInvalidError:
         # Already gone or never delivered; not fatal
         logger.warning(f"[{chat_id}] [AUTO_DELETE] message {msg_id} not found (already deleted?)")
     except Exception as e:
         logger.warning(f"[{chat_id}] [AUTO_DELETE] failed to delete message {msg_id}: {e}")
 
+def _adopt_recovered(task_id: str):
+    """Take over a scheduled message that was sent but not saved before a crash."""
+    for rec in outbox.take(task_id):
+        task_state = load_state().get(task_id, {})
+        last_sent = task_state.get("last_sent")
+        already_known = (
+            task_state.get("scheduled_msg_id") == rec["msg_id"]
+            or (last_sent is not None and last_sent >= rec["planned_at"] - outbox.MATCH_WINDOW_SEC)
+        )
+        if not already_known:
+            update_task_state(task_id, scheduled_msg_id=rec["msg_id"], scheduled_send_at=rec["planned_at"])
+            logger.info(f"[{task_id}] 🔁 adopted recovered scheduled msg id={rec['msg_id']} "
+                        f"for {clock.fmt(rec['planned_at'])}")
+        outbox.done(rec["key"])
+
 async def run_task(task_id, task_conf, state):
     """
     Robust scheduled task:
@@ -71,12 +72,22 @@ async def run_task(task_id, task_conf, state):
       - survives restarts thanks to state.json
     task_conf fields:
       - chat_id: int
-      - message: str
+      - message: str (caption when file is set)
       - interval_minutes: int
+      - file: str (optional, path to a photo/sticker/document)
+      - file_type: "photo" | "sticker" | "document" (optional)
     """
     chat_id = task_conf["chat_id"]
     interval = int(task_conf["interval_minutes"])
 
+    _adopt_recovered(task_id)
+
+    from .task_runner_horizon import unbook_queue
+    try:
+        await unbook_queue(task_id, chat_id)
+    except Exception as e:
+        logger.warning(f"[{task_id}] ⚠️ failed to unbook horizon queue: {e}")
+
     while True:
         # Pull fresh state each loop (handles external edits)
         full_state = load_state()
@@ -84,9 +95,9 @@ async def run_task(task_id, task_conf, state):
         last_sent = get_last_sent(task_id, full_state)
 
         scheduled_msg_id = task_state.get("scheduled_msg_id")
-        scheduled_send_at = _dt(task_state.get("scheduled_send_at"))
+        scheduled_send_at = task_state.get("scheduled_send_at")
 
-        now = _now()
+        now = clock.now()
 
         # 1) If there is a scheduled message pending, manage its lifecycle
         if scheduled_msg_id and scheduled_send_at:
@@ -99,26 +110,28 @@ async def run_task(task_id, task_conf, state):
                     msg = None
 
                 if msg and getattr(msg, "date", None):
-                    actual = msg.date.replace(tzinfo=None)
-                    # Persist last_sent from actual delivery time
-                    update_last_sent(task_id, full_state, actual)
-                    # Clear scheduled markers
-                    task_state["scheduled_msg_id"] = None
-                    task_state["scheduled_send_at"] = None
-                    full_state[task_id] = task_state
-                    save_state(full_state)
-
-                    logger.info(f"[{task_id}] ✅ delivered at {actual} (id={scheduled_msg_id})")
+                    # msg.date is tz-aware UTC -> exact epoch, no local offset drift
+                    actual = clock.to_ts(msg.date)
+                    # Persist last_sent from actual delivery time and clear scheduled markers;
+                    # merged into fresh state, other tasks may have saved during the fetch
+                    update_task_state(task_id, last_sent=actual, scheduled_msg_id=None, scheduled_send_at=None)
+
+                    logger.info(f"[{task_id}] ✅ delivered at {clock.fmt(actual)} (id={scheduled_msg_id})")
+                    eventlog.emit("delivered", task_id=task_id, chat_id=chat_id, msg_id=scheduled_msg_id,
+                                  planned_ts=scheduled_send_at, actual_ts=actual,
+                                  duration=actual - scheduled_send_at)
                     # Schedule deletion (non-blocking)
                     asyncio.create_task(_delete_message_after_delay(chat_id, scheduled_msg_id))
 
                     # Decide next wakeup based on interval
-                    sleep_time = _choose_sleep(actual + timedelta(minutes=interval))
+                    sleep_time = _choose_sleep(actual + interval * 60)
                     await asyncio.sleep(sleep_time)
                     continue
                 else:
                     # Not in history yet -> Telegram lagging. Wait calmly and retry.
                     logger.info(f"[{task_id}] ⏳ waiting for delivery of scheduled msg id={scheduled_msg_id}…")
+                    eventlog.emit("delivery_pending", task_id=task_id, chat_id=chat_id,
+                                  msg_id=scheduled_msg_id, planned_ts=scheduled_send_at)
                     await asyncio.sleep(WAIT_POLL)
                     continue
             else:
@@ -128,38 +141,59 @@ async def run_task(task_id, task_conf, state):
                 continue
 
         # 2) No pending scheduled message. Decide whether to schedule a new one.
-        if last_sent is None or (now - last_sent >= timedelta(minutes=interval)):
+        if last_sent is None or (now - last_sent >= interval * 60):
+            if not leader.check_fence():
+                logger.warning(f"[{task_id}] 🚧 not the leader, skipping send")
+                await asyncio.sleep(SHORT_POLL)
+                continue
+
             # Random pre-send delay (makes schedule look natural & resilient to restarts)
             schedule_delay = random.randint(60, 120)
-            scheduled_time = now + timedelta(seconds=schedule_delay)
+            scheduled_time = now + schedule_delay
 
             logger.info(
                 f"[{task_id}] ⏰ scheduling message in {schedule_delay}s "
-                f"(at {scheduled_time.strftime('%Y-%m-%d %H:%M:%S')})"
+                f"(at {clock.fmt(scheduled_time)})"
             )
             try:
+                # Write-ahead: if we die between send and save, replay finds this message
+                key = outbox.intent(task_id, chat_id, media_cache.sent_text(task_conf), scheduled_time)
                 # Ask Telegram to deliver later; keeps working if our process restarts
-                msg = await client.send_message(
-                    chat_id,
-                    task_conf["message"],
-                    schedule=timedelta(seconds=schedule_delay)
-                )
+                if task_conf.get("file"):
+                    msg = await media_cache.send_media(
+                        chat_id,
+                        task_conf["file"],
+                        caption=task_conf.get("message"),
+                        kind=task_conf.get("file_type"),
+                        schedule=timedelta(seconds=schedule_delay)
+                    )
+                else:
+                    msg = await client.send_message(
+                        chat_id,
+                        task_conf["message"],
+                        schedule=timedelta(seconds=schedule_delay)
+                    )
+                outbox.link(key, msg.id)
                 # Persist schedule metadata
-                task_state["scheduled_msg_id"] = getattr(msg, "id", None)
-                task_state["scheduled_send_at"] = _fmt(scheduled_time)
-                full_state[task_id] = task_state
-                save_state(full_state)
+                task_state = update_task_state(task_id, scheduled_msg_id=getattr(msg, "id", None),
+                                               scheduled_send_at=scheduled_time)
+                outbox.done(key)
 
                 logger.debug(f"[{task_id}] 🗓 scheduled (id={task_state['scheduled_msg_id']}) "
-                             f"for {task_state['scheduled_send_at']}")
+                             f"for {clock.fmt(scheduled_time)}")
+                eventlog.emit("scheduled", task_id=task_id, chat_id=chat_id,
+                              msg_id=task_state["scheduled_msg_id"], planned_ts=scheduled_time,
+                              duration=clock.now() - now)
             except Exception as e:
                 logger.error(f"[{task_id}] ❌ failed to schedule: {e}")
+                eventlog.emit("send_failed", task_id=task_id, chat_id=chat_id,
+                              planned_ts=scheduled_time, error=str(e))
 
             # After scheduling, we can sleep until roughly the scheduled time window
             sleep_time = _choose_sleep(scheduled_time)
         else:
             # Not yet time — report ETA and sleep sparsely
-            mins_left = interval - int((now - last_sent).total_seconds() // 60)
+            mins_left = interval - int((now - last_sent) // 60)
             logger.info(f"[{task_id}] ⌛ Time left: {max(0, mins_left)} minutes")
             sleep_time = 600 if mins_left < 61 else random.randint(1800, 3600)
 
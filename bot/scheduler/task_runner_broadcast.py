@@ -0,0 +1,157 @@
+import asyncio
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetDialogFiltersRequest
+
+from ..client import client
+from . import clock, leader, media_cache
+from .storage import load_state, update_task_state
+from .task_runner import _choose_sleep
+from utils.logger import logger
+from utils import eventlog
+
+DEFAULT_CONCURRENCY = 5
+DEFAULT_MIN_GAP_SEC = 1.0    # min spacing between any two sends of one broadcast
+MAX_FLOOD_WAIT_SEC = 300     # longer flood waits count as a failure for that chat
+SEND_ATTEMPTS = 2            # first try + one retry after a short flood wait
+NOT_LEADER = "not leader"    # failure reason for chats skipped after losing the lease
+
+
+async def _resolve_chats(task_conf: dict) -> list[int]:
+    """chat_ids list and/or every peer in a Telegram chat folder (by title)."""
+    chats = [int(c) for c in task_conf.get("chat_ids", [])]
+    folder = task_conf.get("folder")
+    if folder:
+        result = await client(GetDialogFiltersRequest())
+        for f in getattr(result, "filters", result):
+            title = getattr(f, "title", None)
+            title = getattr(title, "text", title)   # newer layers wrap titles in TextWithEntities
+            if title != folder:
+                continue
+            for peer in list(getattr(f, "pinned_peers", [])) + list(getattr(f, "include_peers", [])):
+                chats.append(await client.get_peer_id(peer))
+            break
+        else:
+            logger.warning(f"[BROADCAST] ⚠️ folder '{folder}' not found")
+    # de-dup, keep order
+    return list(dict.fromkeys(chats))
+
+
+class _RateLimiter:
+    """Spaces out sends across all workers of one fan-out."""
+
+    def __init__(self, min_gap: float):
+        self.min_gap = min_gap
+        self._lock = asyncio.Lock()
+        self._next = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            now = clock.monotonic()
+            if now < self._next:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.min_gap
+
+
+async def _fan_out(task_id: str, task_conf: dict, chats: list[int], round_state: dict) -> dict:
+    """Send to every chat not yet done this round. Returns {chat_id: error} for failures."""
+    sem = asyncio.Semaphore(int(task_conf.get("concurrency", DEFAULT_CONCURRENCY)))
+    limiter = _RateLimiter(float(task_conf.get("min_gap_sec", DEFAULT_MIN_GAP_SEC)))
+    done = set(round_state["done"])
+    failed: dict[str, str] = {}
+
+    async def _send(chat_id: int):
+        async with sem:
+            for attempt in range(1, SEND_ATTEMPTS + 1):
+                await limiter.wait()
+                # Leadership can be lost mid-round; a fenced-off instance must stop sending at once
+                if not leader.check_fence():
+                    failed[str(chat_id)] = NOT_LEADER
+                    return
+                try:
+                    if task_conf.get("file"):
+                        await media_cache.send_media(chat_id, task_conf["file"], caption=task_conf.get("message"),
+                                                     kind=task_conf.get("file_type"))
+                    else:
+                        await client.send_message(chat_id, task_conf["message"])
+                    break
+                except FloodWaitError as e:
+                    if e.seconds > MAX_FLOOD_WAIT_SEC or attempt == SEND_ATTEMPTS:
+                        # No retry left: don't hold a concurrency slot sleeping for nothing
+                        failed[str(chat_id)] = f"FloodWait {e.seconds}s"
+                        return
+                    logger.warning(f"[{task_id}] [BROADCAST] flood wait {e.seconds}s on {chat_id}")
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    failed[str(chat_id)] = f"{type(e).__name__}: {e}"
+                    return
+
+            # Persist every delivery: a restart mid-round must never re-send to this chat
+            round_state["done"].append(chat_id)
+            update_task_state(task_id, round=round_state)
+
+    await asyncio.gather(*(_send(c) for c in chats if c not in done))
+    return failed
+
+
+async def run_broadcast_task(task_id, task_conf, state):
+    """
+    Periodic broadcast of one message to many chats.
+    task_conf fields:
+      - type: "broadcast"
+      - message: str              (caption when file is set)
+      - interval_minutes: int
+      - file / file_type          (optional, same as message tasks)
+      - chat_ids: [int]           (optional if folder given)
+      - folder: str               (optional, Telegram chat folder title)
+      - concurrency: int          (parallel sends, default 5)
+      - min_gap_sec: float        (spacing between sends, default 1.0)
+    State keeps one shared schedule, the in-progress round (chat ids already done,
+    so a restart resumes instead of re-sending) and a summary of the last run.
+    """
+    interval = int(task_conf["interval_minutes"])
+
+    while True:
+        task_state = load_state().get(task_id, {})
+        last_sent = task_state.get("last_sent")
+        round_state = task_state.get("round")
+        now = clock.now()
+
+        due = last_sent is None or now - last_sent >= interval * 60
+        if not due and not round_state:
+            await asyncio.sleep(_choose_sleep(last_sent + interval * 60))
+            continue
+
+        if not leader.check_fence():
+            await asyncio.sleep(300)
+            continue
+
+        if not round_state:
+            round_state = {"started_at": now, "done": []}
+        chats = await _resolve_chats(task_conf)
+        logger.info(f"[{task_id}] [BROADCAST] 📣 fan-out to {len(chats)} chats "
+                    f"({len(round_state['done'])} already done this round)")
+
+        started = clock.monotonic()
+        failed = await _fan_out(task_id, task_conf, chats, round_state)
+        duration = clock.monotonic() - started
+
+        if NOT_LEADER in failed.values():
+            # Round stays open in state; the new leader resumes it from round["done"]
+            logger.warning(f"[{task_id}] [BROADCAST] 🚧 lost leadership mid-round after "
+                           f"{len(round_state['done'])}/{len(chats)} chats, stopping")
+            await asyncio.sleep(300)
+            continue
+
+        update_task_state(task_id, last_sent=round_state["started_at"], round=None, last_run={
+            "at": round_state["started_at"],
+            "duration": round(duration, 2),
+            "ok": len(round_state["done"]),
+            "failed": failed,
+        })
+
+        logger.info(f"[{task_id}] [BROADCAST] ✅ {len(round_state['done'])}/{len(chats)} delivered "
+                    f"in {duration:.1f}s, {len(failed)} failed"
+                    + (f": {', '.join(f'{c} ({err})' for c, err in failed.items())}" if failed else ""))
+        eventlog.emit("broadcast_done", task_id=task_id, planned_ts=round_state["started_at"],
+                      actual_ts=clock.now(), duration=duration, ok=len(round_state["done"]),
+                      failed=len(failed), failed_chats=failed or None)
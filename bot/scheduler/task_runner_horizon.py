@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+import random
+from datetime import datetime, timezone
+
+from telethon.errors import ScheduleTooMuchError
+from telethon.tl.functions.messages import DeleteScheduledMessagesRequest, GetScheduledHistoryRequest
+
+from ..client import client
+from . import clock, leader, media_cache, outbox
+from .storage import load_state, update_task_state
+from .task_runner import _delete_message_after_delay, SHORT_POLL
+from utils.logger import logger
+from utils import eventlog
+
+MAX_CHAT_QUEUED = 90         # Telegram allows 100 scheduled messages per chat (all senders'
+                             # tasks together); leave headroom for polling tasks and the work cycle
+MIN_WAKE = SHORT_POLL        # never spin faster than this
+DELIVERY_GRACE_SEC = 60      # look for a delivered message this long after its planned time
+HISTORY_SCAN = 30            # own recent messages fetched per reconcile to find delivered ids
+
+
+def _signature(task_conf: dict) -> str:
+    """Anything that changes what/where/how often we send invalidates the booked queue."""
+    keys = ("chat_id", "message", "file", "file_type", "interval_minutes")
+    raw = json.dumps({k: task_conf.get(k) for k in keys}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+async def _book(task_id: str, task_conf: dict, at: float) -> tuple[int, str]:
+    """Queue one occurrence in Telegram's scheduled messages (write-ahead via outbox)."""
+    chat_id = task_conf["chat_id"]
+    when = datetime.fromtimestamp(at, timezone.utc)
+    key = outbox.intent(task_id, chat_id, media_cache.sent_text(task_conf), at)
+    if task_conf.get("file"):
+        msg = await media_cache.send_media(chat_id, task_conf["file"], caption=task_conf.get("message"),
+                                           kind=task_conf.get("file_type"), schedule=when)
+    else:
+        msg = await client.send_message(chat_id, task_conf["message"], schedule=when)
+    outbox.link(key, msg.id)
+    return msg.id, key
+
+async def _unbook(chat_id: int, msg_ids: list[int]):
+    if msg_ids:
+        await client(DeleteScheduledMessagesRequest(peer=chat_id, id=msg_ids))
+
+async def unbook_queue(task_id: str, chat_id: int):
+    """Horizon mode switched off: remove still-booked sends so polling mode doesn't double up."""
+    st = load_state()
+    task_state = st.get(task_id, {})
+    queue = task_state.get("queue")
+    if not queue:
+        return
+    await _unbook(chat_id, [e["msg_id"] for e in queue])
+    logger.info(f"[{task_id}] [HORIZON] horizon disabled, unbooked {len(queue)} queued sends")
+    update_task_state(task_id, queue=[], queue_sig=None)
+
+
+async def _reconcile(task_id: str, task_conf: dict, task_state: dict) -> int:
+    """
+    One batch pass: one scheduled-queue fetch + (only if something is due) one history fetch.
+    Moves delivered entries out of the queue, drops entries deleted by hand, and
+    wipes the queue when the task config changed.
+    Returns how many messages the chat's scheduled queue holds (every task, not just ours).
+    """
+    chat_id = task_conf["chat_id"]
+    queue = task_state.setdefault("queue", [])
+    now = clock.now()
+
+    sig = _signature(task_conf)
+    if task_state.get("queue_sig") not in (None, sig) and queue:
+        pending = [e["msg_id"] for e in queue if e["at"] > now]
+        logger.info(f"[{task_id}] [HORIZON] config changed, unbooking {len(pending)} queued sends")
+        await _unbook(chat_id, pending)
+        queue.clear()
+    task_state["queue_sig"] = sig
+
+    scheduled = await client(GetScheduledHistoryRequest(peer=chat_id, hash=0))
+    still_queued = {m.id for m in getattr(scheduled, "messages", [])}
+
+    gone = [e for e in queue if e["msg_id"] not in still_queued]
+    if not gone:
+        return len(still_queued)
+
+    delivered = [e for e in gone if e["at"] <= now + DELIVERY_GRACE_SEC]
+    dropped = [e for e in gone if e["at"] > now + DELIVERY_GRACE_SEC]
+    for e in dropped:
+        logger.warning(f"[{task_id}] [HORIZON] queued send for {clock.fmt(e['at'])} vanished, dropping")
+
+    if delivered:
+        task_state["last_sent"] = max(task_state.get("last_sent") or 0, max(e["at"] for e in delivered))
+        if task_conf.get("auto_delete", True):
+            # Delivered copies get new ids; find them once in recent history
+            recent = await client.get_messages(chat_id, limit=HISTORY_SCAN, from_user="me")
+            text = media_cache.sent_text(task_conf)
+            used = set()
+            for e in delivered:
+                for m in recent:
+                    if m.id in used or (m.message or "") != text or not m.date:
+                        continue
+                    if abs(clock.to_ts(m.date) - e["at"]) <= DELIVERY_GRACE_SEC * 5:
+                        used.add(m.id)
+                        asyncio.create_task(_delete_message_after_delay(chat_id, m.id))
+                        break
+        for e in delivered:
+            eventlog.emit("delivered", task_id=task_id, chat_id=chat_id, msg_id=e["msg_id"],
+                          planned_ts=e["at"], horizon=True)
+        logger.info(f"[{task_id}] [HORIZON] ✅ {len(delivered)} delivered, "
+                    f"last at {clock.fmt(task_state['last_sent'])}")
+
+    gone_ids = {e["msg_id"] for e in gone}
+    task_state["queue"] = [e for e in queue if e["msg_id"] not in gone_ids]
+    return len(still_queued)
+
+async def _fill(task_id: str, task_conf: dict, task_state: dict, horizon_sec: float, chat_queued: int):
+    """Book occurrences until the horizon is covered or the chat's queue reaches MAX_CHAT_QUEUED."""
+    interval = int(task_conf["interval_minutes"]) * 60
+    queue = task_state["queue"]
+    now = clock.now()
+
+    base = queue[-1]["at"] if queue else (task_state.get("last_sent") or now - interval)
+    booked = 0
+    while chat_queued < MAX_CHAT_QUEUED:
+        # Same shape as the polling runner: interval + 60–120s human-looking delay
+        at = max(base + interval, now) + random.randint(60, 120)
+        if at > now + horizon_sec:
+            break
+        if not leader.check_fence():
+            break
+        try:
+            msg_id, key = await _book(task_id, task_conf, at)
+        except ScheduleTooMuchError:
+            # Someone else filled the chat's queue; retry on the next regular wake
+            logger.warning(f"[{task_id}] [HORIZON] chat {task_conf['chat_id']} scheduled queue is full")
+            break
+        queue.append({"msg_id": msg_id, "at": at})
+        # Persist after every booking so a crash never loses a booked id
+        update_task_state(task_id, queue=queue)
+        outbox.done(key)
+        chat_queued += 1
+        base = at
+        booked += 1
+
+    if booked:
+        logger.info(f"[{task_id}] [HORIZON] 🗓 booked {booked} sends, queue now {len(queue)} "
+                    f"(until {clock.fmt(queue[-1]['at'])})")
+        eventlog.emit("horizon_booked", task_id=task_id, chat_id=task_conf["chat_id"],
+                      planned_ts=queue[-1]["at"], booked=booked, queued=len(queue))
+
+def _adopt_polling_state(task_id: str, task_state: dict):
+    """Switching from polling mode: the single pending scheduled message becomes queue entry #1."""
+    if task_state.get("scheduled_msg_id") and task_state.get("scheduled_send_at"):
+        task_state.setdefault("queue", []).append(
+            {"msg_id": task_state["scheduled_msg_id"], "at": task_state["scheduled_send_at"]}
+        )
+        logger.info(f"[{task_id}] [HORIZON] adopted pending scheduled msg {task_state['scheduled_msg_id']}")
+    task_state["scheduled_msg_id"] = None
+    task_state["scheduled_send_at"] = None
+
+def _adopt_recovered(task_id: str, task_state: dict, recovered: list[dict]):
+    """Bookings made right before a crash (found by outbox replay) rejoin the queue."""
+    queue = task_state.setdefault("queue", [])
+    known = {e["msg_id"] for e in queue}
+    for rec in recovered:
+        if rec["msg_id"] not in known:
+            queue.append({"msg_id": rec["msg_id"], "at": rec["planned_at"]})
+            logger.info(f"[{task_id}] [HORIZON] adopted recovered booking {rec['msg_id']}")
+    queue.sort(key=lambda e: e["at"])
+
+
+async def run_horizon_task(task_id, task_conf, state):
+    """
+    Pre-book the next occurrences of a periodic task in Telegram's scheduled-message queue
+    so sends happen on time even while the bot sleeps or is offline.
+    Extra task_conf fields:
+      - horizon_hours: float   (how far ahead to book)
+      - auto_delete: bool      (delete delivered messages like polling mode; default true,
+                                costs one wakeup per delivery)
+    """
+    horizon_sec = float(task_conf["horizon_hours"]) * 3600
+    chat_id = task_conf["chat_id"]
+
+    task_state = load_state().get(task_id, {})
+    _adopt_polling_state(task_id, task_state)
+    recovered = outbox.take(task_id)
+    _adopt_recovered(task_id, task_state, recovered)
+    update_task_state(task_id, **task_state)
+    for rec in recovered:
+        outbox.done(rec["key"])
+
+    while True:
+        task_state = load_state().get(task_id, {})
+
+        try:
+            chat_queued = await _reconcile(task_id, task_conf, task_state)
+            update_task_state(task_id, **task_state)
+            await _fill(task_id, task_conf, task_state, horizon_sec, chat_queued)
+        except Exception as e:
+            logger.error(f"[{task_id}] [HORIZON] ❌ reconcile/book failed: {e}")
+            await asyncio.sleep(MIN_WAKE)
+            continue
+
+        now = clock.now()
+        queue = task_state.get("queue", [])
+        # Wake before the queue runs dry; with auto-delete also right after each delivery
+        wake_at = now + horizon_sec / 2
+        if queue and task_conf.get("auto_delete", True):
+            wake_at = min(wake_at, queue[0]["at"] + DELIVERY_GRACE_SEC)
+        sleep_for = max(MIN_WAKE, wake_at - now)
+        logger.debug(f"[{task_id}] [HORIZON] {len(queue)} queued, next wake in {int(sleep_for)}s "
+                     f"(chat {chat_id})")
+        await asyncio.sleep(sleep_for)
@@ -1,9 +1,15 @@
 import asyncio
 import random
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import timedelta
+
+from telethon.tl.functions.messages import DeleteScheduledMessagesRequest
 
 from bot.client import client
 from utils.logger import logger
+from utils import eventlog
+from . import clock, leader, outbox
+from . import toad_replies
 from .storage import load_state, save_state
 from ..config import TARGET_CHAT_ID
 
@@ -13,8 +19,6 @@ CHAT_ID = TARGET_CHAT_ID
 DEFAULT_JOB = "@toadbot Поход в столовую"
 END_TEXT = "@toadbot Завершить работу"
 
-TIME_FMT = "%Y-%m-%d %H:%M:%S"
-
 # Durations
 WORK_LEN = timedelta(hours=2)   # work session length
 REST_LEN = timedelta(hours=6)   # rest period after work ends
@@ -29,30 +33,28 @@ WAIT_END_POLL = 900  # 15 min when waiting for actual "end work" message
 DELETE_MIN_SEC = 90
 DELETE_MAX_SEC = 200
 
+# Safety margin added to cooldowns reported by the target bot
+REPLY_MARGIN_SEC = 60
 
-# ====== TIME HELPERS ======
-def _now() -> datetime:
-    return datetime.now()
+# Set when state changes outside the loop (bot replies, commands) to cut a sleep short
+_wakeup = asyncio.Event()
 
-def _dt(s: str | None):
-    if not s:
-        return None
-    try:
-        return datetime.strptime(s, TIME_FMT)
-    except Exception:
-        return None
+# Held across a start/end send pair and while applying a bot reply, so a fast reply
+# to the start can't be overwritten by the end's state save (or vice versa)
+_cycle_lock = asyncio.Lock()
 
-def _fmt(dt: datetime | None):
-    return dt.strftime(TIME_FMT) if dt else None
+# Our recent start/end message ids in CHAT_ID; bot replies are matched against these
+# without an API call (the chat is shared, the bot answers everyone)
+OWN_IDS_MAX = 50
+_own_msg_ids: OrderedDict[int, str] = OrderedDict()
 
-def _seconds_until(dt: datetime):
-    return max(0, int((dt - _now()).total_seconds()))
 
-def _choose_sleep_time(target_dt: datetime):
+# ====== TIME HELPERS ======
+def _choose_sleep_time(target_ts: float | None):
     """Adaptive polling delay based on how far event is."""
-    if not target_dt:
+    if not target_ts:
         return LONG_POLL
-    sec_left = _seconds_until(target_dt)
+    sec_left = clock.seconds_until(target_ts)
     if sec_left > 3600:
         return LONG_POLL
     elif sec_left > 600:
@@ -60,6 +62,17 @@ def _choose_sleep_time(target_dt: datetime):
     else:
         return SHORT_POLL
 
+def wake():
+    """Make the chain loop re-read state right away instead of finishing its sleep."""
+    _wakeup.set()
+
+async def _sleep(seconds: int):
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
 
 # ====== STATE MANAGEMENT ======
 def _migrate_state_if_needed(st: dict) -> dict:
@@ -67,10 +80,10 @@ def _migrate_state_if_needed(st: dict) -> dict:
     wc = st.get(TASK_ID, {})
     if "phase" in wc or "last_sent" in wc:
         logger.info(f"[WORK_CYCLE_MIGRATE] Migrating legacy state to new keys")
-        last_sent = _dt(wc.get("last_sent"))
+        last_sent = wc.get("last_sent")
         st[TASK_ID] = {
             "current_job": wc.get("current_job", DEFAULT_JOB),
-            "next_start_at": _fmt(_now()) if last_sent is None else _fmt(last_sent),
+            "next_start_at": clock.now() if last_sent is None else last_sent,
             "scheduled_end_at": None,
             "scheduled_end_id": None,
             "last_end_at": None,
@@ -82,7 +95,7 @@ def _self_check_state(st: dict) -> dict:
     """Ensure state is consistent, fixing if needed."""
     wc = st.get(TASK_ID, {})
     if not wc.get("next_start_at") and not wc.get("scheduled_end_at"):
-        wc["next_start_at"] = _fmt(_now())
+        wc["next_start_at"] = clock.now()
         logger.warning(f"[WORK_CYCLE_SELF_FIX] No planned events found. Setting next_start_at=now")
     st[TASK_ID] = wc
     save_state(st)
@@ -93,22 +106,37 @@ def _get_state():
     wc = st.get(TASK_ID, {})
     return {
         "current_job": wc.get("current_job", DEFAULT_JOB),
-        "next_start_at": _dt(wc.get("next_start_at")),
-        "scheduled_end_at": _dt(wc.get("scheduled_end_at")),
+        "next_start_at": wc.get("next_start_at"),
+        "scheduled_end_at": wc.get("scheduled_end_at"),
         "scheduled_end_id": wc.get("scheduled_end_id"),
-        "last_end_at": _dt(wc.get("last_end_at")),
+        "last_end_at": wc.get("last_end_at"),
     }
 
 def _save_state(**kw):
     st = load_state()
     wc = st.get(TASK_ID, {})
     for k, v in kw.items():
-        wc[k] = _fmt(v) if isinstance(v, datetime) else v
+        wc[k] = v
     st[TASK_ID] = wc
     save_state(st)
     logger.debug(f"[WORK_CYCLE_STATE] {wc}")
 
 
+def is_cycle_text(text: str) -> bool:
+    """Is this one of the work-cycle commands (start job or END_TEXT)?"""
+    if text == END_TEXT:
+        return True
+    return text == load_state().get(TASK_ID, {}).get("current_job", DEFAULT_JOB)
+
+def remember_own_message(msg_id: int, text: str):
+    _own_msg_ids[msg_id] = text
+    while len(_own_msg_ids) > OWN_IDS_MAX:
+        _own_msg_ids.popitem(last=False)
+
+def is_own_cycle_message(msg_id: int | None) -> bool:
+    return msg_id in _own_msg_ids
+
+
 # ====== MESSAGE ACTIONS ======
 async def _delete_message_after_seen(msg_id: int):
     """Delete a message after 90–200s from when it's in chat."""
@@ -123,56 +151,182 @@ async def _delete_message_after_seen(msg_id: int):
 
 async def _send_start_and_schedule_end(current_job: str):
     """Send 'start work' now and schedule 'end work' in WORK_LEN."""
-    msg_start = await client.send_message(CHAT_ID, current_job)
-    asyncio.create_task(_delete_message_after_seen(msg_start.id))
+    async with _cycle_lock:
+        if not leader.check_fence():
+            logger.warning("[WORK_CYCLE_START] 🚧 not the leader, skipping send")
+            return
+        # Write-ahead intents for both sends; replay links whichever made it out
+        start_key = outbox.intent(TASK_ID, CHAT_ID, current_job, clock.now())
+        msg_start = await client.send_message(CHAT_ID, current_job)
+        remember_own_message(msg_start.id, current_job)
+        outbox.link(start_key, msg_start.id)
+        asyncio.create_task(_delete_message_after_seen(msg_start.id))
 
-    scheduled_end_at = _now() + WORK_LEN
-    msg_end = await client.send_message(CHAT_ID, END_TEXT, schedule=WORK_LEN)
-    _save_state(scheduled_end_at=scheduled_end_at, scheduled_end_id=msg_end.id, next_start_at=None)
+        scheduled_end_at = clock.now() + WORK_LEN.total_seconds()
+        end_key = outbox.intent(TASK_ID, CHAT_ID, END_TEXT, scheduled_end_at)
+        msg_end = await client.send_message(CHAT_ID, END_TEXT, schedule=WORK_LEN)
+        outbox.link(end_key, msg_end.id)
+        _save_state(scheduled_end_at=scheduled_end_at, scheduled_end_id=msg_end.id, next_start_at=None)
+        outbox.done(start_key)
+        outbox.done(end_key)
 
+    eventlog.emit("work_start", task_id=TASK_ID, chat_id=CHAT_ID, msg_id=msg_start.id,
+                  actual_ts=clock.now(), job=current_job)
+    eventlog.emit("work_end_scheduled", task_id=TASK_ID, chat_id=CHAT_ID, msg_id=msg_end.id,
+                  planned_ts=scheduled_end_at)
     logger.info(f"[WORK_CYCLE_START] Sent start '{current_job}' | "
-                f"[WORK_CYCLE_SCHEDULE] End scheduled at {scheduled_end_at.strftime(TIME_FMT)} "
+                f"[WORK_CYCLE_SCHEDULE] End scheduled at {clock.fmt(scheduled_end_at)} "
                 f"(msg_id={msg_end.id})")
 
+async def _cancel_scheduled_end(msg_id: int | None):
+    """Drop a pending scheduled 'end work' message from Telegram's queue."""
+    if not msg_id:
+        return
+    try:
+        await client(DeleteScheduledMessagesRequest(peer=CHAT_ID, id=[msg_id]))
+        logger.info(f"[WORK_CYCLE_CANCEL] Scheduled end msg {msg_id} cancelled")
+    except Exception as e:
+        logger.warning(f"[WORK_CYCLE_CANCEL] Failed to cancel scheduled end {msg_id}: {e}")
+
+async def _reschedule_end(seconds_left: int):
+    """Replace the pending 'end work' message with one matching the real remaining time."""
+    if not leader.check_fence():
+        return
+    st = _get_state()
+    await _cancel_scheduled_end(st["scheduled_end_id"])
+    delay = seconds_left + REPLY_MARGIN_SEC
+    scheduled_end_at = clock.now() + delay
+    key = outbox.intent(TASK_ID, CHAT_ID, END_TEXT, scheduled_end_at)
+    msg_end = await client.send_message(CHAT_ID, END_TEXT, schedule=timedelta(seconds=delay))
+    outbox.link(key, msg_end.id)
+    _save_state(scheduled_end_at=scheduled_end_at, scheduled_end_id=msg_end.id, next_start_at=None)
+    outbox.done(key)
+    eventlog.emit("work_end_scheduled", task_id=TASK_ID, chat_id=CHAT_ID, msg_id=msg_end.id,
+                  planned_ts=scheduled_end_at, rescheduled=True)
+    logger.info(f"[WORK_CYCLE_SCHEDULE] End rescheduled at {clock.fmt(scheduled_end_at)} "
+                f"(msg_id={msg_end.id})")
+
+
+# ====== TARGET BOT REPLIES ======
+async def apply_bot_reply(text: str):
+    """
+    Feed a reply from the target bot into the cycle:
+      - cooldown  -> cancel any pending end, next start = now + cooldown
+      - working   -> (re)schedule end to the real remaining work time
+      - finished  -> end confirmed, next start = now + REST_LEN
+      - error     -> logged only
+    """
+    parsed = toad_replies.parse_reply(text)
+    if not parsed:
+        return
+    kind, seconds_left = parsed
+    logger.info(f"[WORK_CYCLE_REPLY] {kind} (left={seconds_left}s)")
+    eventlog.emit("bot_reply", task_id=TASK_ID, chat_id=CHAT_ID, kind=kind, seconds_left=seconds_left)
+    async with _cycle_lock:
+        applied = await _apply_reply(kind, seconds_left, text)
+    if applied:
+        wake()
+
+async def _apply_reply(kind: str, seconds_left: int | None, text: str) -> bool:
+    """State change for one classified reply. Caller holds _cycle_lock."""
+    now = clock.now()
+    st = _get_state()
+
+    if kind == toad_replies.COOLDOWN and seconds_left is not None:
+        await _cancel_scheduled_end(st["scheduled_end_id"])
+        next_start = now + seconds_left + REPLY_MARGIN_SEC
+        _save_state(scheduled_end_at=None, scheduled_end_id=None, next_start_at=next_start)
+        logger.info(f"[WORK_CYCLE_NEXT] Next start moved to {clock.fmt(next_start)}")
+    elif kind == toad_replies.WORKING and seconds_left is not None:
+        await _reschedule_end(seconds_left)
+    elif kind == toad_replies.FINISHED:
+        if st["scheduled_end_id"]:
+            asyncio.create_task(_delete_message_after_seen(st["scheduled_end_id"]))
+        next_start = now + REST_LEN.total_seconds()
+        _save_state(last_end_at=now, scheduled_end_at=None,
+                    scheduled_end_id=None, next_start_at=next_start)
+        eventlog.emit("work_end", task_id=TASK_ID, chat_id=CHAT_ID, msg_id=st["scheduled_end_id"],
+                      planned_ts=st["scheduled_end_at"], actual_ts=now, confirmed=True)
+        logger.info(f"[WORK_CYCLE_END] Confirmed by bot at {clock.fmt(now)} | "
+                    f"[WORK_CYCLE_NEXT] Next start at {clock.fmt(next_start)}")
+    elif kind == toad_replies.ERROR:
+        logger.warning(f"[WORK_CYCLE_REPLY] Target bot reported an error: {text[:200]}")
+        return False
+    else:
+        return False
+    return True
+
+
+async def _adopt_recovered():
+    """
+    Finish a start/end pair interrupted by a crash:
+      - end message made it out  -> adopt it as the pending end
+      - only start made it out   -> schedule the end for the rest of WORK_LEN
+    """
+    recovered = outbox.take(TASK_ID)
+    if not recovered:
+        return
+    ends = [r for r in recovered if r["text"] == END_TEXT]
+    starts = [r for r in recovered if r["text"] != END_TEXT]
+    st = _get_state()
+    last_end_at = st["last_end_at"] or 0
+
+    if ends and not st["scheduled_end_id"] and last_end_at < ends[-1]["planned_at"]:
+        _save_state(scheduled_end_at=ends[-1]["planned_at"], scheduled_end_id=ends[-1]["msg_id"],
+                    next_start_at=None)
+        logger.info(f"[WORK_CYCLE_RECOVER] Adopted scheduled end msg_id={ends[-1]['msg_id']}")
+    elif starts and not ends and not st["scheduled_end_id"] and last_end_at < starts[-1]["planned_at"]:
+        remaining = starts[-1]["planned_at"] + WORK_LEN.total_seconds() - clock.now()
+        logger.info(f"[WORK_CYCLE_RECOVER] Start msg_id={starts[-1]['msg_id']} sent without end, "
+                    f"scheduling end")
+        asyncio.create_task(_delete_message_after_seen(starts[-1]["msg_id"]))
+        await _reschedule_end(max(0, int(remaining)))
+
+    for rec in recovered:
+        outbox.done(rec["key"])
+
 
 # ====== MAIN LOOP ======
 async def run_chain_task():
     logger.info(f"[WORK_CYCLE_LOOP] Started")
+    await _adopt_recovered()
     st = _get_state()
 
     # Initialize if empty
     if st["next_start_at"] is None and st["scheduled_end_at"] is None:
-        _save_state(next_start_at=_now(), current_job=st["current_job"])
+        _save_state(next_start_at=clock.now(), current_job=st["current_job"])
         logger.info(f"[WORK_CYCLE_INIT] Set next_start_at=now")
 
     while True:
         st = _get_state()
-        now = _now()
+        now = clock.now()
 
         # If end is scheduled
         if st["scheduled_end_at"] and st["scheduled_end_id"]:
             if now >= st["scheduled_end_at"]:
                 # Delete the "end work" message once it's actually sent
                 asyncio.create_task(_delete_message_after_seen(st["scheduled_end_id"]))
-                next_start = now + REST_LEN
+                next_start = now + REST_LEN.total_seconds()
                 _save_state(last_end_at=now, scheduled_end_at=None,
                             scheduled_end_id=None, next_start_at=next_start)
-                logger.info(f"[WORK_CYCLE_END] Ended at {now.strftime(TIME_FMT)} | "
-                            f"[WORK_CYCLE_NEXT] Next start at {next_start.strftime(TIME_FMT)}")
-                await asyncio.sleep(SHORT_POLL)
+                eventlog.emit("work_end", task_id=TASK_ID, chat_id=CHAT_ID, msg_id=st["scheduled_end_id"],
+                              planned_ts=st["scheduled_end_at"], actual_ts=now)
+                logger.info(f"[WORK_CYCLE_END] Ended at {clock.fmt(now)} | "
+                            f"[WORK_CYCLE_NEXT] Next start at {clock.fmt(next_start)}")
+                await _sleep(SHORT_POLL)
             else:
-                await asyncio.sleep(_choose_sleep_time(st["scheduled_end_at"]))
+                await _sleep(_choose_sleep_time(st["scheduled_end_at"]))
             continue
 
         # If waiting for next start
         if st["next_start_at"]:
             if now >= st["next_start_at"]:
                 await _send_start_and_schedule_end(st["current_job"])
-                await asyncio.sleep(SHORT_POLL)
+                await _sleep(SHORT_POLL)
             else:
-                await asyncio.sleep(_choose_sleep_time(st["next_start_at"]))
+                await _sleep(_choose_sleep_time(st["next_start_at"]))
             continue
 
         # Safety fallback
         logger.debug("[WORK_CYCLE_IDLE] No events planned. Sleeping long.")
-        await asyncio.sleep(LONG_POLL)
+        await _sleep(LONG_POLL)
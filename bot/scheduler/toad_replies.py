@@ -0,0 +1,45 @@
+import re
+
+# Reply kinds understood by the work cycle
+COOLDOWN = "cooldown"   # can't start work yet, remaining rest time given
+WORKING = "working"     # toad is already working, remaining work time given
+FINISHED = "finished"   # work ended (reply to END_TEXT)
+ERROR = "error"         # bot refused / generic failure
+
+# Ordered: first match wins. Compiled once at import.
+REPLY_PATTERNS = [
+    (FINISHED, re.compile(r"(заверш\w*\s+работ|работа\s+(?:окончена|завершена)|вернул\w*\s+с\s+работы)", re.I)),
+    (WORKING,  re.compile(r"(уже\s+(?:работает|на\s+работе)|сейчас\s+на\s+работе|забрать\s+жабу\s+можно\s+через)", re.I)),
+    (COOLDOWN, re.compile(r"((?:отдыха\w*|устал\w*)\b.*\bчерез|(?:отправить|пойти|сходить)\s+\w*\s*(?:на\s+работу\s+)?можно\s+через|можно\s+будет\s+\w+.*через)", re.I | re.S)),
+    (ERROR,    re.compile(r"(произошла\s+ошибка|не\s+можешь|нельзя|нет\s+жабы)", re.I)),
+]
+
+_AFTER_RE   = re.compile(r"через\s+(.{1,40})", re.I)
+_HOURS_RE   = re.compile(r"(\d+)\s*ч", re.I)
+_MINUTES_RE = re.compile(r"(\d+)\s*м", re.I)
+_SECONDS_RE = re.compile(r"(\d+)\s*с", re.I)
+
+
+def parse_duration(text: str) -> int | None:
+    """Extract '... через 1ч 20м' / 'через 3 ч. 15 мин.' into seconds."""
+    m = _AFTER_RE.search(text)
+    if not m:
+        return None
+    tail = m.group(1)
+    h = _HOURS_RE.search(tail)
+    mi = _MINUTES_RE.search(tail)
+    s = _SECONDS_RE.search(tail)
+    if not (h or mi or s):
+        return None
+    return (int(h.group(1)) * 3600 if h else 0) \
+        + (int(mi.group(1)) * 60 if mi else 0) \
+        + (int(s.group(1)) if s else 0)
+
+def parse_reply(text: str) -> tuple[str, int | None] | None:
+    """Classify a target-bot reply. Returns (kind, seconds_left) or None if irrelevant."""
+    if not text:
+        return None
+    for kind, pattern in REPLY_PATTERNS:
+        if pattern.search(text):
+            return kind, parse_duration(text)
+    return None
@@ -0,0 +1,159 @@
+import asyncio
+import atexit
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from .logger import log_dir
+
+EVENT_FILE = log_dir / "events.jsonl"
+
+BATCH_SIZE = 50     # flush as soon as this many records are buffered
+FLUSH_EVERY = 5     # ...or at least this often (seconds) from run_flusher()
+
+MAX_BYTES = 5 * 1024 ** 2   # rotate events.jsonl -> events.jsonl.1 past this size
+BACKUPS = 3                 # rotated files kept (events.jsonl.1 .. .3)
+RECENT_PER_TASK = 100       # events per task kept in memory for .events
+
+# Fixed record schema; every field except ts/type is optional
+FIELDS = ("ts", "type", "task_id", "chat_id", "msg_id", "planned_ts", "actual_ts", "duration")
+
+_buffer: list[dict] = []
+_lock = threading.Lock()
+
+# In-memory index so .events never re-parses the file: task_id -> last RECENT_PER_TASK events
+_recent: dict[str, deque] = {}
+
+
+def _index(record: dict):
+    task_id = record.get("task_id")
+    if task_id is not None:
+        _recent.setdefault(task_id, deque(maxlen=RECENT_PER_TASK)).append(record)
+
+def _seed_index():
+    """Fill the index from the current file once at startup (bounded by MAX_BYTES)."""
+    if not EVENT_FILE.exists():
+        return
+    with EVENT_FILE.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                _index(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+
+_seed_index()
+
+
+def emit(event_type: str, task_id: str | None = None, chat_id: int | None = None,
+         msg_id: int | None = None, planned_ts: float | None = None,
+         actual_ts: float | None = None, duration: float | None = None, **extra):
+    """Queue one typed event. None fields are omitted to keep lines short."""
+    record = {
+        "ts": round(time.time(), 3),
+        "type": event_type,
+        "task_id": task_id,
+        "chat_id": chat_id,
+        "msg_id": msg_id,
+        "planned_ts": planned_ts,
+        "actual_ts": actual_ts,
+        "duration": round(duration, 4) if duration is not None else None,
+        **extra,
+    }
+    record = {k: v for k, v in record.items() if v is not None}
+    with _lock:
+        _buffer.append(record)
+        _index(record)
+        full = len(_buffer) >= BATCH_SIZE
+    if full:
+        flush()
+
+def flush():
+    """Append buffered events to the JSONL file in one write."""
+    with _lock:
+        if not _buffer:
+            return
+        batch = _buffer[:]
+        _buffer.clear()
+    data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in batch)
+    with EVENT_FILE.open("a", encoding="utf-8") as f:
+        f.write(data)
+        size = f.tell()
+    if size > MAX_BYTES:
+        _rotate()
+
+def _backup(n: int) -> Path:
+    return EVENT_FILE.with_name(f"{EVENT_FILE.name}.{n}")
+
+def _rotate():
+    for n in range(BACKUPS - 1, 0, -1):
+        if _backup(n).exists():
+            _backup(n).replace(_backup(n + 1))
+    EVENT_FILE.replace(_backup(1))
+
+def clear():
+    """Drop all recorded events (current file, rotated files, buffer and index)."""
+    with _lock:
+        _buffer.clear()
+        _recent.clear()
+    for path in [EVENT_FILE, *(_backup(n) for n in range(1, BACKUPS + 1))]:
+        path.unlink(missing_ok=True)
+
+atexit.register(flush)
+
+async def run_flusher():
+    while True:
+        await asyncio.sleep(FLUSH_EVERY)
+        await asyncio.to_thread(flush)
+
+
+def read(event_type: str | None = None, task_id: str | None = None, since: float | None = None):
+    """Iterate all events on disk (rotated files first, oldest to newest), optionally filtered."""
+    flush()
+    paths = [_backup(n) for n in range(BACKUPS, 0, -1)] + [EVENT_FILE]
+    for path in paths:
+        if not path.exists():
+            continue
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event_type and r.get("type") != event_type:
+                    continue
+                if task_id and r.get("task_id") != task_id:
+                    continue
+                if since and r.get("ts", 0) < since:
+                    continue
+                yield r
+
+def recent(task_id: str, limit: int = 10) -> list[dict]:
+    """Last `limit` events of one task (at most RECENT_PER_TASK), from memory."""
+    with _lock:
+        records = list(_recent.get(task_id, ()))
+    return records[-limit:] if limit > 0 else []
+
+def latest_by_task() -> dict[str, dict]:
+    """Most recent event per task_id, from memory."""
+    with _lock:
+        return {task_id: records[-1] for task_id, records in _recent.items() if records}
+
+def export_columnar(path: Path) -> int:
+    """
+    Write all events as gzipped column arrays: {"columns": [...], "rows": n, "data": {col: [...]}}.
+    Extra fields become additional columns. Returns the number of rows.
+    """
+    rows = list(read())
+    columns = list(FIELDS)
+    for r in rows:
+        for k in r:
+            if k not in columns:
+                columns.append(k)
+    data = {c: [r.get(c) for r in rows] for c in columns}
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"columns": columns, "rows": len(rows), "data": data}, f,
+                  ensure_ascii=False, separators=(",", ":"))
+    return len(rows)
@@ -0,0 +1,93 @@
+import asyncio
+import linecache
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+FRAMES = 25     # traceback depth kept per allocation
+TOP_N = 15      # rows per report section
+
+# Drop allocations made by the profiler itself and import machinery
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+# Last two snapshots: diff() compares previous -> current
+_prev: tracemalloc.Snapshot | None = None
+_curr: tracemalloc.Snapshot | None = None
+
+
+def _fmt_size(n: float, signed: bool = True) -> str:
+    sign = ("-" if n < 0 else "+") if signed else ""
+    n = abs(n)
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{sign}{n:.0f}{unit}" if unit == "B" else f"{sign}{n:.1f}{unit}"
+        n /= 1024
+    return f"{sign}{n:.1f}GiB"
+
+def _where(stat) -> str:
+    frame = stat.traceback[0]
+    return f"{'/'.join(Path(frame.filename).parts[-2:])}:{frame.lineno}"
+
+def _take() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+def is_running() -> bool:
+    return tracemalloc.is_tracing()
+
+def start():
+    """Start tracing and take the baseline snapshot."""
+    global _prev, _curr
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(FRAMES)
+    _prev, _curr = None, _take()
+
+def stop():
+    global _prev, _curr
+    tracemalloc.stop()
+    _prev = _curr = None
+
+def snapshot() -> str:
+    """Take a new snapshot; the previous one becomes the diff base."""
+    global _prev, _curr
+    _prev, _curr = _curr, _take()
+    current, peak = tracemalloc.get_traced_memory()
+    return (f"📸 Snapshot taken ({len(_curr.traces)} traces)\n"
+            f"Traced now: {_fmt_size(current, signed=False)} | peak: {_fmt_size(peak, signed=False)}")
+
+def diff(limit: int = TOP_N) -> str:
+    """Top allocation sites by size growth and by count growth between the last two snapshots."""
+    if _prev is None or _curr is None:
+        return "Need two snapshots: run .memprof snapshot first."
+
+    stats = _curr.compare_to(_prev, "lineno")
+    by_size = sorted(stats, key=lambda s: s.size_diff, reverse=True)[:limit]
+    by_count = sorted(stats, key=lambda s: s.count_diff, reverse=True)[:limit]
+    total = sum(s.size_diff for s in stats)
+
+    lines = [f"Total growth: {_fmt_size(total)}", "", "Top by size growth:"]
+    for s in by_size:
+        if s.size_diff <= 0:
+            break
+        lines.append(f"  {_fmt_size(s.size_diff):>10}  {s.count_diff:+6d} blk  {_where(s)}")
+    lines += ["", "Top by count growth:"]
+    for s in by_count:
+        if s.count_diff <= 0:
+            break
+        lines.append(f"  {s.count_diff:+6d} blk  {_fmt_size(s.size_diff):>10}  {_where(s)}")
+    return "\n".join(lines)
+
+def task_counts(limit: int = TOP_N) -> str:
+    """asyncio tasks grouped by coroutine name — catches piling-up create_task() calls."""
+    counts = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        counts[getattr(coro, "__qualname__", repr(coro))] += 1
+    lines = [f"Asyncio tasks: {sum(counts.values())}"]
+    for name, n in counts.most_common(limit):
+        lines.append(f"  {n:5d}  {name}")
+    return "\n".join(lines)
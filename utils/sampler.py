@@ -0,0 +1,72 @@
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_INTERVAL = 0.005   # 200 Hz — low overhead, enough resolution for second-long runs
+MAX_DEPTH = 128
+
+# Innermost Python frames of a thread that is blocked, not burning CPU:
+# the event loop waiting in epoll/select, pool workers waiting for work, lock/condition waits
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _idle(code) -> bool:
+    return (Path(code.co_filename).name, code.co_name) in IDLE_LEAVES
+
+def _label(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+def sample(seconds: float, interval: float = DEFAULT_INTERVAL) -> tuple[Counter, Counter, int, int]:
+    """
+    Sample the stacks of every thread except the caller for `seconds`.
+    Meant to run in a worker thread (asyncio.to_thread) so the event loop thread
+    keeps running and gets sampled too. Samples of idle threads (see IDLE_LEAVES)
+    are only counted, so waiting doesn't drown out the real hot spots.
+    Returns (collapsed stacks, self-time per function, number of sampling ticks, idle samples).
+    """
+    me = threading.get_ident()
+    stacks: Counter = Counter()
+    self_time: Counter = Counter()
+    ticks = 0
+    idle = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if _idle(frame.f_code):
+                idle += 1
+                continue
+            frames = []
+            while frame is not None and len(frames) < MAX_DEPTH:
+                frames.append(_label(frame.f_code))
+                frame = frame.f_back
+            if not frames:
+                continue
+            self_time[frames[0]] += 1
+            frames.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(frames))] += 1
+        ticks += 1
+        time.sleep(interval)
+
+    return stacks, self_time, ticks, idle
+
+def collapsed(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed-stack format, ready for flamegraph.pl / speedscope."""
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+def top_self(self_time: Counter, limit: int = 15) -> str:
+    total = sum(self_time.values()) or 1
+    return "\n".join(
+        f"{count * 100 / total:5.1f}%  {name}" for name, count in self_time.most_common(limit)
+    )